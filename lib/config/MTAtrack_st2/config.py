@@ -92,6 +92,30 @@ cfg.TEST.TEMPLATE_SIZE = 128  #要
 cfg.TEST.SEARCH_FACTOR = 5.0  #要
 cfg.TEST.SEARCH_SIZE = 320  #要
 cfg.TEST.EPOCH = 500
+cfg.TEST.FLAT_WEIGHTS = False  # load the memory-mapped weight file from tracking/export_weights.py
+cfg.TEST.BACKEND = "torch"  # torch, or onnx to run the graphs from tracking/export_model.py with onnxruntime
+cfg.TEST.DEVICE = "cuda"  # cuda or cpu
+cfg.TEST.NUM_THREADS = 0  # intra-op threads for cpu inference, 0 keeps the torch default
+cfg.TEST.PREFETCH_DEPTH = 8  # frames decoded ahead of the tracker, 0 reads each frame when it is tracked
+cfg.TEST.PREFETCH_WORKERS = 2  # frame decoding threads
+cfg.TEST.POS_CACHE_SIZE = 16  # cached position embeddings, one per sample map size and padding, 0 disables the cache
+cfg.TEST.INTERLEAVE_ENC_DEC = False  # run decoder layer i right after encoder layer i
+cfg.TEST.FUSED_ATTENTION = False  # scaled dot product attention kernel, no attention weights
+cfg.TEST.FOLD_QUERY_PATH = False  # precompute the frame-invariant query path of the decoder
+cfg.TEST.FUSE_CORNER_HEAD = False  # run both corner branches as one grouped conv tower
+cfg.TEST.FOLD_BATCHNORM = False  # fold the batch norms into the preceding convs
+cfg.TEST.RAW_BGR_INPUT = False  # feed the uint8 BGR crops, normalization and channel swap folded into conv1
+cfg.TEST.QUANTIZE_DYNAMIC = False  # dynamic int8 linear layers in the transformer and MLP heads (cpu only)
+cfg.TEST.BACKBONE_INT8 = False  # statically quantized backbone from tracking/calibrate_backbone.py (cpu only)
+cfg.TEST.JIT = False  # run the frozen TorchScript graphs from tracking/export_model.py
+cfg.TEST.CHANNELS_LAST = False  # channels-last convs and input patches
+cfg.TEST.AUTOCAST_BF16 = False  # run the network under bf16 autocast (cpu only, needs bf16 support e.g. avx512_bf16/amx)
+cfg.TEST.ROI_CROP = False  # crop with one cv.warpAffine into reused buffers, sample_target up to interpolation rounding
+cfg.TEST.ATTN_CAPTURE = edict()  # attention maps saved as .npy, see lib/models/MTAtrack/attention.py
+cfg.TEST.ATTN_CAPTURE.LAYERS = []  # fnmatch patterns of the attention module names, empty disables the capture
+cfg.TEST.ATTN_CAPTURE.EVERY = 1  # capture one frame out of EVERY
+cfg.TEST.ATTN_CAPTURE.FRAMES = []  # only capture these frames (transformer calls), empty captures all
+cfg.TEST.ATTN_CAPTURE.MAX_FILES = 1000  # the oldest maps are deleted beyond MAX_FILES
 cfg.TEST.UPDATE_INTERVALS = edict()
 cfg.TEST.UPDATE_INTERVALS.LASOT = [200]
 cfg.TEST.UPDATE_INTERVALS.GOT10K_TEST = [200]
@@ -1,12 +1,15 @@
 """
 Basic MTAtrack Model (Spatial-only).
 """
+import inspect
+from contextlib import nullcontext
+
 import torch
 from torch import nn
 
 from lib.utils.misc import NestedTensor
 
-from .backbone import build_backbone
+from .backbone import build_backbone, NestedRectTensor
 from .transformer import build_transformer
 from .head import build_box_head
 from lib.utils.box_ops import box_xyxy_to_cxcywh
@@ -33,6 +36,7 @@ class MTAtrackS(nn.Module):
         self.bottleneck = nn.Conv2d(backbone.num_channels, hidden_dim, kernel_size=1)  # the bottleneck layer
         self.aux_loss = aux_loss
         self.head_type = head_type
+        self.transformer_mode = "all"  # "interleave" runs encoder and decoder layers alternately at inference
         if head_type == "CORNER":
             self.feat_sz_s = int(box_head.feat_sz)
             self.feat_len_s = int(box_head.feat_sz ** 2)
@@ -62,8 +66,9 @@ class MTAtrackS(nn.Module):
         # Forward the transformer encoder and decoder
         # output_embed, enc_mem = self.transformer(seq_dict["feat"], seq_dict["mask"], self.query_embed.weight,
         #                                          seq_dict["pos"], return_encoder_output=True)
-        output_embed, enc_mem0, enc_mem5 = self.transformer(seq_dict["feat"], seq_dict["mask"], self.query_embed.weight,
-                                                 seq_dict["pos"], return_encoder_output=True)
+        output_embed, enc_mem0, enc_mem5 = self.transformer(seq_dict["feat"], get_key_padding_mask(seq_dict),
+                                                 self.query_embed.weight, seq_dict["pos"], mode=self.transformer_mode,
+                                                 return_encoder_output=True)
 
         # Forward the corner head
         # out, outputs_coord = self.forward_box_head(output_embed, enc_mem1, enc_mem2)
@@ -75,6 +80,8 @@ class MTAtrackS(nn.Module):
         hs: output embeddings (1, B, N, C)
         memory: encoder embeddings (HW1+HW2, B, C)"""
         if self.head_type == "CORNER":
+            if not torch.is_grad_enabled():
+                return self.forward_corner_head_inference(hs, memory0, memory5)
             # adjust shape
             enc_opt0 = memory0[-self.feat_len_s:].transpose(0, 1)  # encoder output for the search region (B, HW, C)
             # enc_opt0_min = enc_opt0.min(dim=2)[0].unsqueeze(2)
@@ -108,18 +115,46 @@ class MTAtrackS(nn.Module):
                 out['aux_outputs'] = self._set_aux_loss(outputs_coord)
             return out, outputs_coord
 
+    def forward_corner_head_inference(self, hs, memory0, memory5):
+        """
+        Corner head path used when no gradient is needed, working directly in the (B, C, HW) layout.
+        The product of the sigmoid gating of memory0 with memory5 is done in place in a single buffer,
+        and the attention weighting is a broadcasted multiply, so neither the (B, HW, C, N) outer product
+        nor its permuted copy is built. With a single query the weighting is done in place.
+        hs: output embeddings (1, B, N, C)
+        memory: encoder embeddings (HW1+HW2, B, C)"""
+        enc_opt5 = memory5[-self.feat_len_s:].permute(1, 2, 0)  # encoder output for the search region (B, C, HW)
+        bs, C, HW = enc_opt5.size()
+        # no out= variant, it cannot be exported to ONNX
+        enc_opt = memory0[-self.feat_len_s:].permute(1, 2, 0).sigmoid().mul_(enc_opt5)
+        dec_opt = hs.squeeze(0)  # (B, N, C)
+        att = torch.matmul(dec_opt, enc_opt)  # (B, N, HW)
+        Nq = att.size(1)
+        if Nq == 1:
+            opt = enc_opt.mul_(att)  # (B, C, HW)
+        else:
+            opt = enc_opt.unsqueeze(1) * att.unsqueeze(2)  # (B, N, C, HW)
+        opt_feat = opt.view(-1, C, self.feat_sz_s, self.feat_sz_s)
+        # run the corner head
+        outputs_coord = box_xyxy_to_cxcywh(self.box_head(opt_feat))
+        outputs_coord_new = outputs_coord.view(bs, Nq, 4)
+        out = {'pred_boxes': outputs_coord_new}
+        return out, outputs_coord_new
+
     def adjust(self, output_back: list, pos_embed: list):
         """
         """
-        src_feat, mask = output_back[-1].decompose()
-        assert mask is not None
+        src_feat = output_back[-1].tensors
+        # known on the host for the crops of the trackers, see NestedRectTensor
+        padded = output_back[-1].padded if isinstance(output_back[-1], NestedRectTensor) else True
         # reduce channel
         feat = self.bottleneck(src_feat)  # (B, C, H, W)
         # adjust shapes
         feat_vec = feat.flatten(2).permute(2, 0, 1)  # HWxBxC
         pos_embed_vec = pos_embed[-1].flatten(2).permute(2, 0, 1)  # HWxBxC
-        mask_vec = mask.flatten(1)  # BxHW
-        return {"feat": feat_vec, "mask": mask_vec, "pos": pos_embed_vec}
+        # the dense mask of unpadded crops is not built, the transformer runs unmasked on them
+        mask_vec = output_back[-1].mask.flatten(1) if padded else None  # BxHW
+        return {"feat": feat_vec, "mask": mask_vec, "pos": pos_embed_vec, "padded": padded}
 
     @torch.jit.unused
     def _set_aux_loss(self, outputs_coord):
@@ -130,17 +165,36 @@ class MTAtrackS(nn.Module):
                 for b in outputs_coord[:-1]]
 
 
-def build_MTAtracks(cfg):
-    backbone = build_backbone(cfg)  # backbone and positional encoding are built together
-    transformer = build_transformer(cfg)
+def get_key_padding_mask(seq_dict):
+    """The mask of seq_dict, None when it is known that no token is padded, the attention then runs unmasked."""
+    return seq_dict["mask"] if seq_dict.get("padded", True) else None
+
+
+# load_state_dict(..., assign=True) (torch >= 2.1) replaces the parameters with the loaded tensors
+ASSIGN_LOAD = 'assign' in inspect.signature(nn.Module.load_state_dict).parameters
+
+
+def build_device(inference=False):
+    """Device context the modules of a network are built in. For inference, when the torch version can load with
+    assign, the parameters are created on the meta device, without memory nor init, and must all be replaced with
+    load_state_dict(..., strict=True, assign=True). Older versions build on the cpu and copy the weights."""
+    return torch.device('meta') if inference and ASSIGN_LOAD else nullcontext()
+
+
+def build_MTAtracks(cfg, inference=False):
+    """inference: build for loading a trained checkpoint, without the ImageNet weights (see build_device)"""
+    # the corner head computes its coordinate buffers, which are not saved in checkpoints
     box_head = build_box_head(cfg)
-    model = MTAtrackS(
-        backbone,
-        transformer,
-        box_head,
-        num_queries=cfg.MODEL.NUM_OBJECT_QUERIES,
-        aux_loss=cfg.TRAIN.DEEP_SUPERVISION,
-        head_type=cfg.MODEL.HEAD_TYPE
-    )
+    with build_device(inference):
+        backbone = build_backbone(cfg, pretrained=not inference)  # backbone and positional encoding are built together
+        transformer = build_transformer(cfg)
+        model = MTAtrackS(
+            backbone,
+            transformer,
+            box_head,
+            num_queries=cfg.MODEL.NUM_OBJECT_QUERIES,
+            aux_loss=cfg.TRAIN.DEEP_SUPERVISION,
+            head_type=cfg.MODEL.HEAD_TYPE
+        )
 
     return model
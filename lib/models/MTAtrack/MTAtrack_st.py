@@ -4,7 +4,7 @@ MTAtrack-ST Model (Spatio-Temporal).
 from .backbone import build_backbone
 from .transformer import build_transformer
 from .head import build_box_head, MLP
-from lib.models.MTAtrack.MTAtrack_s import MTAtrackS
+from lib.models.MTAtrack.MTAtrack_s import MTAtrackS, get_key_padding_mask, build_device
 
 
 class MTAtrackST(MTAtrackS):
@@ -34,8 +34,9 @@ class MTAtrackST(MTAtrackS):
         if self.aux_loss:
             raise ValueError("Deep supervision is not supported.")
         # Forward the transformer encoder and decoder
-        output_embed, enc_mem0, enc_mem5 = self.transformer(seq_dict["feat"], seq_dict["mask"], self.query_embed.weight,
-                                                 seq_dict["pos"], return_encoder_output=True)
+        output_embed, enc_mem0, enc_mem5 = self.transformer(seq_dict["feat"], get_key_padding_mask(seq_dict),
+                                                 self.query_embed.weight, seq_dict["pos"], mode=self.transformer_mode,
+                                                 return_encoder_output=True)
         # Forward the corner head
         out, outputs_coord = self.forward_head(output_embed, enc_mem0, enc_mem5, run_box_head=run_box_head, run_cls_head=run_cls_head)  #改变了！！
         return out, outputs_coord, output_embed
@@ -58,19 +59,22 @@ class MTAtrackST(MTAtrackS):
             return out_dict, None
 
 
-def build_MTAtrackst(cfg):
-    backbone = build_backbone(cfg)  # backbone and positional encoding are built together
-    transformer = build_transformer(cfg)
+def build_MTAtrackst(cfg, inference=False):
+    """inference: build for loading a trained checkpoint, without the ImageNet weights (see build_device)"""
+    # the corner head computes its coordinate buffers, which are not saved in checkpoints
     box_head = build_box_head(cfg)
-    cls_head = MLP(cfg.MODEL.HIDDEN_DIM, cfg.MODEL.HIDDEN_DIM, 1, cfg.MODEL.NLAYER_HEAD)   #加了一个多层感知器来预测检测的准确率？？
-    model = MTAtrackST(
-        backbone,
-        transformer,
-        box_head,
-        num_queries=cfg.MODEL.NUM_OBJECT_QUERIES,
-        aux_loss=cfg.TRAIN.DEEP_SUPERVISION,
-        head_type=cfg.MODEL.HEAD_TYPE,
-        cls_head=cls_head
-    )
+    with build_device(inference):
+        backbone = build_backbone(cfg, pretrained=not inference)  # backbone and positional encoding are built together
+        transformer = build_transformer(cfg)
+        cls_head = MLP(cfg.MODEL.HIDDEN_DIM, cfg.MODEL.HIDDEN_DIM, 1, cfg.MODEL.NLAYER_HEAD)   #加了一个多层感知器来预测检测的准确率？？
+        model = MTAtrackST(
+            backbone,
+            transformer,
+            box_head,
+            num_queries=cfg.MODEL.NUM_OBJECT_QUERIES,
+            aux_loss=cfg.TRAIN.DEEP_SUPERVISION,
+            head_type=cfg.MODEL.HEAD_TYPE,
+            cls_head=cls_head
+        )
 
     return model
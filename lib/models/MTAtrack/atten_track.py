@@ -145,7 +145,7 @@ class DecoderCFALayer(nn.Module):
         tgt2 = self.multihead_attn(query=self.with_pos_embed(tgt, pos_dec),
                                    key=self.with_pos_embed(memory, pos_enc),
                                    value=memory, attn_mask=memory_mask,
-                                   key_padding_mask=memory_key_padding_mask)[0]
+                                   key_padding_mask=memory_key_padding_mask, need_weights=False)[0]
         tgt = tgt + self.dropout1(tgt2)
         tgt = self.norm1(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt))))
@@ -213,13 +213,13 @@ class FeatureFusionLayer(nn.Module):
        #对应Feature future layer的两个ECA
         q1 = k1 = self.with_pos_embed(src1, pos_src1)
         src12 = self.self_attn1(q1, k1, value=src1, attn_mask=src1_mask,
-                               key_padding_mask=src1_key_padding_mask)[0]   #输出attn_output: (L, N, E)
+                               key_padding_mask=src1_key_padding_mask, need_weights=False)[0]   #输出attn_output: (L, N, E)
         src1 = src1 + self.dropout11(src12)
         src1 = self.norm11(src1)
 
         q2 = k2 = self.with_pos_embed(src2, pos_src2)
         src22 = self.self_attn2(q2, k2, value=src2, attn_mask=src2_mask,
-                               key_padding_mask=src2_key_padding_mask)[0]
+                               key_padding_mask=src2_key_padding_mask, need_weights=False)[0]
         src2 = src2 + self.dropout21(src22)
         src2 = self.norm21(src2)
 
@@ -227,11 +227,11 @@ class FeatureFusionLayer(nn.Module):
         src12 = self.multihead_attn1(query=self.with_pos_embed(src1, pos_src1), #自己的q
                                    key=self.with_pos_embed(src2, pos_src2), #对方的k v
                                    value=src2, attn_mask=src2_mask,
-                                   key_padding_mask=src2_key_padding_mask)[0]
+                                   key_padding_mask=src2_key_padding_mask, need_weights=False)[0]
         src22 = self.multihead_attn2(query=self.with_pos_embed(src2, pos_src2), #自己的q
                                    key=self.with_pos_embed(src1, pos_src1), #对方的k v
                                    value=src1, attn_mask=src1_mask,
-                                   key_padding_mask=src1_key_padding_mask)[0]
+                                   key_padding_mask=src1_key_padding_mask, need_weights=False)[0]
 
         src1 = src1 + self.dropout12(src12)   #dropout
         src1 = self.norm12(src1)    #norm
@@ -0,0 +1,269 @@
+"""
+Inference implementation of nn.MultiheadAttention on the fused scaled dot product attention kernel,
+and opt-in capture of the attention maps for debugging.
+"""
+import os
+import fnmatch
+from collections import deque
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn, Tensor
+from typing import Optional
+
+# the fused kernel is available from torch 2.0, older versions compute the attention explicitly
+_HAS_SDPA = hasattr(F, 'scaled_dot_product_attention')
+
+
+class InferenceMultiheadAttention(nn.Module):
+    """
+    Drop-in replacement of a trained nn.MultiheadAttention (sequence first layout, no bias_k/bias_v, no zero_attn)
+    for inference. The in_proj weights are split into plain q/k/v nn.Linear layers and the attention runs in
+    F.scaled_dot_product_attention, so the (B, nhead, L, S) attention weights are never materialised (torch < 2.0
+    has no such kernel, the attention is then computed explicitly).
+    Only with need_weights=True (see AttentionCapture) the attention is computed explicitly and the weights
+    averaged over the heads are returned, as nn.MultiheadAttention does.
+    """
+    def __init__(self, mha: nn.MultiheadAttention):
+        super().__init__()
+        if mha.bias_k is not None or mha.add_zero_attn or getattr(mha, 'batch_first', False):
+            raise ValueError("bias_k/bias_v, add_zero_attn and batch_first are not supported.")
+        self.embed_dim = mha.embed_dim
+        self.num_heads = mha.num_heads
+        self.head_dim = mha.embed_dim // mha.num_heads
+        if mha._qkv_same_embed_dim:
+            w_q, w_k, w_v = mha.in_proj_weight.chunk(3)
+        else:
+            w_q, w_k, w_v = mha.q_proj_weight, mha.k_proj_weight, mha.v_proj_weight
+        b_q, b_k, b_v = mha.in_proj_bias.chunk(3) if mha.in_proj_bias is not None else (None, None, None)
+        self.q_proj = _make_linear(w_q, b_q)
+        self.k_proj = _make_linear(w_k, b_k)
+        self.v_proj = _make_linear(w_v, b_v)
+        self.out_proj = _make_linear(mha.out_proj.weight, mha.out_proj.bias)
+
+    def forward(self, query: Tensor, key: Tensor, value: Tensor, key_padding_mask: Optional[Tensor] = None,
+                need_weights: bool = False, attn_mask: Optional[Tensor] = None):
+        L, B, _ = query.shape
+        S = key.shape[0]
+        q = self._split_heads(self.q_proj(query), L, B)
+        k = self._split_heads(self.k_proj(key), S, B)
+        v = self._split_heads(self.v_proj(value), S, B)
+        mask = _merge_masks(attn_mask, key_padding_mask, q.dtype)
+        if need_weights:
+            out, weights = self._attention_with_weights(q, k, v, mask)
+        elif _HAS_SDPA:
+            out, weights = F.scaled_dot_product_attention(q, k, v, attn_mask=mask), None  # (B, nhead, L, head_dim)
+        else:
+            out, weights = self._attention_with_weights(q, k, v, mask)[0], None
+        out = out.permute(2, 0, 1, 3).reshape(L, B, self.embed_dim)
+        return self.out_proj(out), weights
+
+    def _attention_with_weights(self, q: Tensor, k: Tensor, v: Tensor, mask: Optional[Tensor]):
+        scores = torch.matmul(q, k.transpose(-2, -1)) * self.head_dim ** -0.5  # (B, nhead, L, S)
+        if mask is not None:
+            scores = scores.masked_fill(~mask, float('-inf')) if mask.dtype == torch.bool else scores + mask
+        attn = scores.softmax(dim=-1)
+        return torch.matmul(attn, v), attn.mean(dim=1)
+
+    def _split_heads(self, x: Tensor, length: int, bs: int):
+        return x.view(length, bs, self.num_heads, self.head_dim).permute(1, 2, 0, 3)  # (B, nhead, L, head_dim)
+
+
+def _make_linear(weight: Tensor, bias: Optional[Tensor]):
+    linear = nn.Linear(weight.shape[1], weight.shape[0], bias=bias is not None).to(weight.device)
+    with torch.no_grad():
+        linear.weight.copy_(weight)
+        if bias is not None:
+            linear.bias.copy_(bias)
+    return linear
+
+
+def _merge_masks(attn_mask: Optional[Tensor], key_padding_mask: Optional[Tensor], dtype):
+    """Convert the nn.MultiheadAttention masks (True or -inf where attention is not allowed) to one
+    scaled_dot_product_attention mask (True where attention is allowed, or an additive float mask)."""
+    if key_padding_mask is not None:
+        key_padding_mask = key_padding_mask[:, None, None, :].to(torch.bool)  # (B, 1, 1, S)
+    if attn_mask is None:
+        return None if key_padding_mask is None else ~key_padding_mask
+    if attn_mask.dtype == torch.bool:
+        mask = ~attn_mask
+        return mask if key_padding_mask is None else mask & ~key_padding_mask
+    mask = attn_mask.to(dtype)
+    return mask if key_padding_mask is None else mask.masked_fill(key_padding_mask, float('-inf'))
+
+
+def get_projections(attn: nn.Module):
+    """The float (w_q, b_q, w_k, b_k, w_v, b_v, w_o, b_o) of an nn.MultiheadAttention or an
+    InferenceMultiheadAttention, missing biases are zeros."""
+    if isinstance(attn, nn.MultiheadAttention):
+        attn = InferenceMultiheadAttention(attn)
+    projections = ()
+    for linear in (attn.q_proj, attn.k_proj, attn.v_proj, attn.out_proj):
+        bias = linear.bias if linear.bias is not None else linear.weight.new_zeros(linear.weight.shape[0])
+        projections += (linear.weight.detach(), bias.detach())
+    return projections
+
+
+class QueryFoldedAttention(nn.Module):
+    """
+    Attention of a few queries over many keys (the cross attention of the decoder, with a single query) with
+    the chain of linear maps reordered, for inference. The key projection is applied to the queries (W_k^T q)
+    instead of to every key, and the value and output projections are composed per head (W_o,h W_v,h) and applied
+    once to the attention weighted sum of the values (the weights of a query sum to 1, so the value bias becomes
+    a constant bias). The key bias adds the same score to every key of a query and cancels in the softmax.
+    The result is the one of the original attention up to floating point rounding.
+    """
+    def __init__(self, attn: nn.Module):
+        super().__init__()
+        w_q, b_q, w_k, _, w_v, b_v, w_o, b_o = get_projections(attn)
+        self.embed_dim = attn.embed_dim
+        self.num_heads = attn.num_heads
+        self.head_dim = attn.embed_dim // attn.num_heads
+        h, d, c = self.num_heads, self.head_dim, self.embed_dim
+        scale = self.head_dim ** -0.5
+        self.q_proj = _make_linear(w_q * scale, b_q * scale)
+        with torch.no_grad():
+            self.register_buffer('w_k', w_k.reshape(h, d, c).clone())
+            w_ov = torch.matmul(w_o.reshape(c, h, d).permute(1, 0, 2), w_v.reshape(h, d, c))  # (h, C_out, C)
+            self.register_buffer('w_ov', w_ov)
+            self.register_buffer('b_ov', torch.matmul(w_o, b_v) + b_o)
+
+    def project_query(self, query: Tensor):
+        """(N, B, C) queries --> (B, nhead, N, C) vectors whose dot products with the keys are the scores."""
+        N, B, _ = query.shape
+        q = self.q_proj(query).view(N, B, self.num_heads, self.head_dim)
+        return torch.einsum('nbhd,hdc->bhnc', q, self.w_k)
+
+    def attend(self, qk: Tensor, key: Tensor, value: Tensor, key_padding_mask: Optional[Tensor] = None,
+               need_weights: bool = False, attn_mask: Optional[Tensor] = None):
+        scores = torch.einsum('bhnc,sbc->bhns', qk, key)  # (B, nhead, N, S)
+        mask = _merge_masks(attn_mask, key_padding_mask, scores.dtype)
+        if mask is not None:
+            scores = scores.masked_fill(~mask, float('-inf')) if mask.dtype == torch.bool else scores + mask
+        attn = scores.softmax(dim=-1)
+        context = torch.einsum('bhns,sbc->bhnc', attn, value)  # attention weighted values of every head
+        out = torch.einsum('bhnc,hoc->nbo', context, self.w_ov) + self.b_ov
+        return out, (attn.mean(dim=1) if need_weights else None)
+
+    def forward(self, query: Optional[Tensor], key: Tensor, value: Tensor, key_padding_mask: Optional[Tensor] = None,
+                need_weights: bool = False, attn_mask: Optional[Tensor] = None, qk: Optional[Tensor] = None):
+        """qk: the projected queries when they are precomputed, query is then ignored."""
+        if qk is None:
+            qk = self.project_query(query)
+        return self.attend(qk, key, value, key_padding_mask, need_weights, attn_mask)
+
+
+class SingleTokenAttention(nn.Module):
+    """
+    Self-attention over a single token (the decoder self-attention with a single query), for inference.
+    The softmax over one key is 1, so the attention is the composed linear map W_o (W_v x + b_v) + b_o of the value.
+    """
+    def __init__(self, attn: nn.Module):
+        super().__init__()
+        _, _, _, _, w_v, b_v, w_o, b_o = get_projections(attn)
+        self.embed_dim = attn.embed_dim
+        self.num_heads = attn.num_heads
+        self.proj = _make_linear(torch.matmul(w_o, w_v), torch.matmul(w_o, b_v) + b_o)
+
+    def forward(self, query: Tensor, key: Tensor, value: Tensor, key_padding_mask: Optional[Tensor] = None,
+                need_weights: bool = False, attn_mask: Optional[Tensor] = None):
+        assert value.shape[0] == 1
+        weights = value.new_ones((value.shape[1], 1, 1)) if need_weights else None
+        return self.proj(value), weights
+
+
+def replace_attention(module: nn.Module):
+    """Replace every nn.MultiheadAttention of a module in eval mode by an InferenceMultiheadAttention, in place."""
+    for name, child in module.named_children():
+        if isinstance(child, nn.MultiheadAttention):
+            setattr(module, name, InferenceMultiheadAttention(child))
+        else:
+            replace_attention(child)
+    return module
+
+
+# the attention modules whose weights can be captured
+ATTENTION_MODULES = (nn.MultiheadAttention, InferenceMultiheadAttention, QueryFoldedAttention, SingleTokenAttention)
+
+
+class AttentionStore(object):
+    """Bounded on-disk store of attention maps, one .npy file per map. The oldest files are deleted when
+    more than max_files maps have been written."""
+    def __init__(self, save_dir: str, max_files=1000):
+        self.save_dir = save_dir
+        self.max_files = max_files
+        self.files = deque()
+        os.makedirs(save_dir, exist_ok=True)
+
+    def save(self, frame_id: int, name: str, weights: Tensor):
+        path = os.path.join(self.save_dir, "%06d_%s.npy" % (frame_id, name))
+        np.save(path, weights.detach().float().cpu().numpy())
+        self.files.append(path)
+        while len(self.files) > self.max_files:
+            old_path = self.files.popleft()
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+
+class AttentionCapture(object):
+    """
+    Capture of the attention maps of selected attention layers through forward hooks.
+    The layers call their attention with need_weights=False. For the captured frames, a pre-hook turns
+    need_weights on for the selected layers and a hook saves the head-averaged weights (B, L, S) to the store,
+    so nothing is computed when the capture is not attached or the frame is not sampled.
+    A frame is one forward pass of network.transformer.
+    layers: fnmatch patterns of the module names, e.g. "transformer.encoder.layers.5.self_attn" or "*multihead_attn"
+    every: capture one frame out of `every`
+    frames: if given, only these frames are captured (still subsampled by `every`)
+    """
+    def __init__(self, store: AttentionStore, layers=("*",), every=1, frames=None):
+        self.store = store
+        self.layers = list(layers)
+        self.every = max(int(every), 1)
+        self.frames = set(frames) if frames is not None else None
+        self.frame_id = -1
+        self.handles = []
+
+    def attach(self, network: nn.Module):
+        """Raise when a pattern selects no attention module, e.g. the self-attention of the first decoder layer,
+        which fusion.fold_query_path removes."""
+        names = [name for name, module in network.named_modules() if isinstance(module, ATTENTION_MODULES)]
+        unmatched = [pattern for pattern in self.layers if not fnmatch.filter(names, pattern)]
+        if unmatched:
+            raise ValueError("No attention layer matches %s." % ", ".join(unmatched))
+        self.handles.append(network.transformer.register_forward_pre_hook(self._next_frame))
+        for name, module in network.named_modules():
+            if isinstance(module, ATTENTION_MODULES) and self._is_selected(name):
+                self.handles.append(module.register_forward_pre_hook(self._request_weights, with_kwargs=True))
+                self.handles.append(module.register_forward_hook(self._make_save_hook(name)))
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def is_active(self):
+        if self.frame_id < 0 or self.frame_id % self.every != 0:
+            return False
+        return self.frames is None or self.frame_id in self.frames
+
+    def _is_selected(self, name: str):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.layers)
+
+    def _next_frame(self, module, args):
+        self.frame_id += 1
+
+    def _request_weights(self, module, args, kwargs):
+        if self.is_active():
+            kwargs["need_weights"] = True
+            return args, kwargs
+
+    def _make_save_hook(self, name: str):
+        def save_hook(module, args, output):
+            if self.is_active() and output[1] is not None:
+                self.store.save(self.frame_id, name, output[1])
+                # the layers only use the attention output
+                return output[0], None
+        return save_hook
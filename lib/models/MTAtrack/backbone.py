@@ -51,6 +51,52 @@ class FrozenBatchNorm2d(torch.nn.Module):
         return x * scale + bias
 
 
+class NestedRectTensor(NestedTensor):
+    """
+    NestedTensor whose padding mask is described on the host by the unpadded rectangle (x0, y0, x1, y1) of every
+    sample, as the crops of the trackers are padded around a rectangle. The dense mask is only built, on the
+    device of the tensors, when it is read.
+    """
+    def __init__(self, tensors, rects: list):
+        self._mask = None
+        super().__init__(tensors, None)
+        self.rects = rects
+
+    @property
+    def mask(self):
+        if self._mask is None:
+            b, _, h, w = self.tensors.shape
+            if not self.padded:
+                self._mask = torch.zeros((b, h, w), dtype=torch.bool, device=self.tensors.device)
+            else:
+                self._mask = torch.ones((b, h, w), dtype=torch.bool, device=self.tensors.device)
+                for i, (x0, y0, x1, y1) in enumerate(self.rects):
+                    self._mask[i, y0:y1, x0:x1] = False
+        return self._mask
+
+    @mask.setter
+    def mask(self, mask):
+        self._mask = mask
+
+    @property
+    def padded(self):
+        h, w = self.tensors.shape[-2:]
+        return any(rect != (0, 0, w, h) for rect in self.rects)
+
+    def downsample(self, x):
+        """The feature map x of the tensors with the rectangles of the nearest neighbour downsampled mask,
+        the same mask as F.interpolate(mask, size=x.shape[-2:]) when the sizes are integer multiples."""
+        H, W = self.tensors.shape[-2:]
+        h, w = x.shape[-2:]
+        rects = [(_ceil_div(x0 * w, W), _ceil_div(y0 * h, H), _ceil_div(x1 * w, W), _ceil_div(y1 * h, H))
+                 for x0, y0, x1, y1 in self.rects]
+        return NestedRectTensor(x, rects)
+
+
+def _ceil_div(a: int, b: int):
+    return -(-a // b)
+
+
 class BackboneBase(nn.Module):
 
     def __init__(self, backbone: nn.Module, train_backbone: bool, num_channels: int, return_interm_layers: bool):
@@ -70,6 +116,10 @@ class BackboneBase(nn.Module):
         xs = self.body(tensor_list.tensors)
         out: Dict[str, NestedTensor] = {}
         for name, x in xs.items():
+            if isinstance(tensor_list, NestedRectTensor):
+                # no interpolation, the mask follows from the rectangles
+                out[name] = tensor_list.downsample(x)
+                continue
             m = tensor_list.mask
             assert m is not None
             mask = F.interpolate(m[None].float(), size=x.shape[-2:]).to(torch.bool)[0]
@@ -83,12 +133,14 @@ class Backbone(BackboneBase):
                  train_backbone: bool,
                  return_interm_layers: bool ,
                  dilation: bool,
-                 freeze_bn: bool):
+                 freeze_bn: bool,
+                 pretrained: bool = True):
         norm_layer = FrozenBatchNorm2d if freeze_bn else nn.BatchNorm2d
         # here is different from the original DETR because we use feature from block3
+        # (layer4, avgpool and fc are not built)
         backbone = getattr(resnet_module, name)(
             replace_stride_with_dilation=[False, dilation, False],
-            pretrained=is_main_process(), norm_layer=norm_layer, last_layer='layer3')
+            pretrained=pretrained and is_main_process(), norm_layer=norm_layer, last_layer='layer3')
         num_channels = 256 if name in ('resnet18', 'resnet34') else 1024
         super().__init__(backbone, train_backbone, num_channels, return_interm_layers)
 
@@ -109,12 +161,13 @@ class Joiner(nn.Sequential):
         return out, pos
 
 
-def build_backbone(cfg):
+def build_backbone(cfg, pretrained=True):
+    """pretrained: load the ImageNet weights of the ResNet, not needed when a checkpoint is loaded afterwards"""
     position_embedding = build_position_encoding(cfg)
     train_backbone = cfg.TRAIN.BACKBONE_MULTIPLIER > 0
     return_interm_layers = cfg.MODEL.PREDICT_MASK
     backbone = Backbone(cfg.MODEL.BACKBONE.TYPE, train_backbone, return_interm_layers,
-                        cfg.MODEL.BACKBONE.DILATION, cfg.TRAIN.FREEZE_BACKBONE_BN)
+                        cfg.MODEL.BACKBONE.DILATION, cfg.TRAIN.FREEZE_BACKBONE_BN, pretrained=pretrained)
     model = Joiner(backbone, position_embedding)
     model.num_channels = backbone.num_channels
     return model
@@ -0,0 +1,152 @@
+"""
+Export of a trained MTAtrack network to frozen TorchScript or ONNX graphs for inference.
+The backbone is exported once per input size (template and search region) and the transformer with the heads
+once for the fixed number of templates, so every graph is specialised to the shapes the tracker feeds it.
+"""
+import copy
+from contextlib import contextmanager
+
+import torch
+from torch import nn
+
+from lib.utils.misc import NestedTensor
+from .position_encoding import PositionEmbeddingCache
+from .fusion import has_raw_input
+
+
+class BackboneGraph(nn.Module):
+    """forward_backbone with tensors in and out: (img, mask) --> (feat, mask, pos)."""
+    def __init__(self, network):
+        super().__init__()
+        self.network = network
+
+    def forward(self, img, mask):
+        out = self.network.forward_backbone(NestedTensor(img, mask))
+        return out["feat"], out["mask"], out["pos"]
+
+
+class TransformerGraph(nn.Module):
+    """forward_transformer and the heads with tensors in and out: (feat, mask, pos) --> (pred_boxes, [pred_logits])."""
+    def __init__(self, network):
+        super().__init__()
+        self.network = network
+        self.run_cls_head = getattr(network, 'cls_head', None) is not None
+
+    def forward(self, feat, mask, pos):
+        seq_dict = {"feat": feat, "mask": mask, "pos": pos}
+        if self.run_cls_head:
+            out, _, _ = self.network.forward_transformer(seq_dict, run_box_head=True, run_cls_head=True)
+            return out["pred_boxes"], out["pred_logits"]
+        out, _, _ = self.network.forward_transformer(seq_dict, run_box_head=True)
+        return (out["pred_boxes"],)
+
+
+def get_graph_paths(prefix: str, template_size: int, search_size: int, ext='pt'):
+    return {"template": "%s_backbone%d.%s" % (prefix, template_size, ext),
+            "search": "%s_backbone%d.%s" % (prefix, search_size, ext),
+            "transformer": "%s_transformer.%s" % (prefix, ext)}
+
+
+@contextmanager
+def bypass_position_cache(network: nn.Module):
+    """The position embedding cache is keyed on the host, an exported graph computes the embedding every time."""
+    pos_embed = network.backbone[1]
+    if isinstance(pos_embed, PositionEmbeddingCache):
+        network.backbone[1] = pos_embed.position_embedding
+    try:
+        yield network
+    finally:
+        network.backbone[1] = pos_embed
+
+
+def export_graphs(network: nn.Module, template_size: int, search_size: int, num_templates: int, prefix: str,
+                  device='cuda'):
+    """Trace, freeze and save the graphs of a network in eval mode, on the device they will run on."""
+    with bypass_position_cache(network):
+        graphs = trace_graphs(network, template_size, search_size, num_templates, device)
+    paths = get_graph_paths(prefix, template_size, search_size)
+    for name, graph in graphs.items():
+        torch.jit.save(graph, paths[name])
+    return paths
+
+
+def export_onnx(network: nn.Module, template_size: int, search_size: int, num_templates: int, prefix: str,
+                opset_version=14):
+    """Export the graphs of a float network in eval mode to ONNX, to be run with onnxruntime on cpu.
+    Dynamically quantized layers and the int8 backbone have no ONNX export, they should be turned off."""
+    # exported from a cpu copy, the network of the caller stays on its device
+    network = copy.deepcopy(network).cpu()
+    raw = has_raw_input(network)
+    paths = get_graph_paths(prefix, template_size, search_size, ext='onnx')
+    with bypass_position_cache(network), torch.no_grad():
+        backbone = BackboneGraph(network).eval()
+        for name, sz in [("template", template_size), ("search", search_size)]:
+            torch.onnx.export(backbone, _get_inputs(sz, 'cpu', raw), paths[name], opset_version=opset_version,
+                              input_names=["img", "img_mask"], output_names=["feat", "mask", "pos"])
+        z_feat, z_mask, z_pos = backbone(*_get_inputs(template_size, 'cpu', raw))
+        x_feat, x_mask, x_pos = backbone(*_get_inputs(search_size, 'cpu', raw))
+        inputs = (torch.cat([z_feat] * num_templates + [x_feat], dim=0),
+                  torch.cat([z_mask] * num_templates + [x_mask], dim=1),
+                  torch.cat([z_pos] * num_templates + [x_pos], dim=0))
+        transformer = TransformerGraph(network).eval()
+        output_names = ["pred_boxes", "pred_logits"] if transformer.run_cls_head else ["pred_boxes"]
+        torch.onnx.export(transformer, inputs, paths["transformer"], opset_version=opset_version,
+                          input_names=["feat", "mask", "pos"], output_names=output_names)
+    return paths
+
+
+def trace_graphs(network: nn.Module, template_size: int, search_size: int, num_templates: int, device='cuda'):
+    graphs = {}
+    raw = has_raw_input(network)
+    backbone = BackboneGraph(network).eval()
+    with torch.no_grad():
+        for name, sz in [("template", template_size), ("search", search_size)]:
+            graphs[name] = torch.jit.freeze(torch.jit.trace(backbone, _get_inputs(sz, device, raw)))
+        z_feat, z_mask, z_pos = graphs["template"](*_get_inputs(template_size, device, raw))
+        x_feat, x_mask, x_pos = graphs["search"](*_get_inputs(search_size, device, raw))
+        inputs = (torch.cat([z_feat] * num_templates + [x_feat], dim=0),
+                  torch.cat([z_mask] * num_templates + [x_mask], dim=1),
+                  torch.cat([z_pos] * num_templates + [x_pos], dim=0))
+        graphs["transformer"] = torch.jit.freeze(torch.jit.trace(TransformerGraph(network).eval(), inputs))
+    return graphs
+
+
+def _get_inputs(sz, device, raw=False):
+    """Random image patch without padding, uint8 for a network taking the raw crops."""
+    mask = torch.zeros(1, sz, sz, dtype=torch.bool, device=device)
+    if raw:
+        return torch.randint(0, 256, (1, 3, sz, sz), dtype=torch.uint8, device=device), mask
+    return torch.randn(1, 3, sz, sz, device=device), mask
+
+
+class GraphNetwork(nn.Module):
+    """
+    Drop-in replacement of the network in the trackers that runs the exported graphs.
+    It exposes forward_backbone and forward_transformer with the inputs and outputs of MTAtrackS/MTAtrackST,
+    the dict and NestedTensor wrapping is only done at the graph boundaries.
+    """
+    def __init__(self, graphs: dict, template_size: int, search_size: int, feat_len_s: int):
+        super().__init__()
+        self.backbones = nn.ModuleDict({str(template_size): graphs["template"], str(search_size): graphs["search"]})
+        self.transformer = graphs["transformer"]
+        self.feat_len_s = feat_len_s
+
+    @classmethod
+    def load(cls, prefix: str, template_size: int, search_size: int, feat_len_s: int, device='cuda'):
+        paths = get_graph_paths(prefix, template_size, search_size)
+        graphs = {}
+        for name, path in paths.items():
+            graph = torch.jit.load(path, map_location=device).eval()
+            graphs[name] = torch.jit.optimize_for_inference(graph)
+        return cls(graphs, template_size, search_size, feat_len_s)
+
+    def forward_backbone(self, input: NestedTensor):
+        feat, mask, pos = self.backbones[str(input.tensors.shape[-1])](input.tensors, input.mask)
+        return {"feat": feat, "mask": mask, "pos": pos}
+
+    def forward_transformer(self, seq_dict, run_box_head=True, run_cls_head=False):
+        outputs = self.transformer(seq_dict["feat"], seq_dict["mask"], seq_dict["pos"])
+        out = {'pred_boxes': outputs[0]}
+        if run_cls_head and len(outputs) > 1:
+            out['pred_logits'] = outputs[1]
+        return out, outputs[0], None
@@ -0,0 +1,148 @@
+"""
+Inference-time simplifications of a trained MTAtrack network.
+"""
+from typing import Optional
+
+import torch
+from torch import nn, Tensor
+
+from .backbone import FrozenBatchNorm2d
+from .attention import QueryFoldedAttention, SingleTokenAttention, get_projections
+
+
+def fold_batchnorm(module: nn.Module):
+    """Fold every Conv2d directly followed by a (Frozen)BatchNorm2d into a single biased Conv2d, in place.
+    A conv and a norm are taken as consecutive when they are registered one after the other in the same parent,
+    which is how the ResNet stem, the ResNet blocks (and their downsample) and the conv() blocks of the corner
+    head are built. The norm layers are replaced by nn.Identity. The running statistics are used, so the result
+    matches the network in eval mode."""
+    for child in module.children():
+        fold_batchnorm(child)
+    names = list(module._modules.keys())
+    for name_conv, name_bn in zip(names[:-1], names[1:]):
+        conv, bn = module._modules[name_conv], module._modules[name_bn]
+        if isinstance(conv, nn.Conv2d) and isinstance(bn, (nn.BatchNorm2d, FrozenBatchNorm2d)) \
+                and bn.running_var is not None:
+            module._modules[name_conv] = _fold_conv_bn(conv, bn)
+            module._modules[name_bn] = nn.Identity()
+    return module
+
+
+def _fold_conv_bn(conv: nn.Conv2d, bn):
+    eps = bn.eps if isinstance(bn, nn.BatchNorm2d) else 1e-5  # FrozenBatchNorm2d uses a fixed eps
+    with torch.no_grad():
+        bn_weight = bn.weight if bn.weight is not None else torch.ones_like(bn.running_var)
+        bn_bias = bn.bias if bn.bias is not None else torch.zeros_like(bn.running_mean)
+        scale = bn_weight * (bn.running_var + eps).rsqrt()
+        conv_bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        fused = nn.Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size, stride=conv.stride,
+                          padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True,
+                          padding_mode=conv.padding_mode).to(conv.weight.device)
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((conv_bias - bn.running_mean) * scale + bn_bias)
+    return fused
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class RawInputConv(nn.Module):
+    """
+    First conv of the backbone taking the raw uint8 crops (0-255, BGR channel order by default) instead of the
+    normalized RGB ones. The scaling of (x / 255 - mean) / std and the channel swap are folded into the weights,
+    only the shift by 255 * mean is left, so that the zero padding of the conv still stands for a normalized 0.
+    """
+    def __init__(self, conv: nn.Conv2d, mean=IMAGENET_MEAN, std=IMAGENET_STD, bgr=True):
+        super().__init__()
+        perm = [2, 1, 0] if bgr else [0, 1, 2]
+        device = conv.weight.device
+        mean = torch.tensor(mean, device=device)[perm].view(1, 3, 1, 1)
+        std = torch.tensor(std, device=device)[perm].view(1, 3, 1, 1)
+        with torch.no_grad():
+            self.conv = nn.Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size,
+                                  stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                                  groups=conv.groups, bias=conv.bias is not None).to(device)
+            self.conv.weight.copy_(conv.weight[:, perm] / (255 * std))
+            if conv.bias is not None:
+                self.conv.bias.copy_(conv.bias)
+        self.register_buffer('offset', 255 * mean)
+
+    def forward(self, x):
+        # the uint8 crop minus the float offset is the float input, in a single pass
+        return self.conv(x - self.offset)
+
+
+def fold_input_normalization(network: nn.Module, bgr=True):
+    """Make the backbone of a network take the raw uint8 crops (BGR by default, as read by OpenCV), in place."""
+    body = network.backbone[0].body
+    if not isinstance(getattr(body, 'conv1', None), nn.Conv2d):
+        raise ValueError("The input normalization can only be folded into a float conv1.")
+    body.conv1 = RawInputConv(body.conv1, bgr=bgr)
+    return network
+
+
+def has_raw_input(network: nn.Module):
+    body = network.backbone[0].body
+    return isinstance(getattr(body, 'conv1', None), RawInputConv)
+
+
+class ConstantQueryDecoderLayer(nn.Module):
+    """
+    First (post-norm) decoder layer with its frame-invariant part precomputed, for inference.
+    Its input tgt is zero and query_pos is the learned query embedding, so its self-attention only sees the value
+    bias: the output of the self-attention, the residual and norm1 is norm1(W_o b_v + b_o) for every query and
+    every frame. The projected queries of the cross attention (a QueryFoldedAttention) are constant as well.
+    """
+    def __init__(self, layer: nn.Module, query_embed: torch.Tensor):
+        super().__init__()
+        if not isinstance(layer.multihead_attn, QueryFoldedAttention):
+            layer.multihead_attn = QueryFoldedAttention(layer.multihead_attn)
+        _, _, _, _, w_v, b_v, w_o, b_o = get_projections(layer.self_attn)
+        with torch.no_grad():
+            tgt = layer.norm1(torch.matmul(w_o, b_v) + b_o).expand_as(query_embed).unsqueeze(1)  # (N, 1, C)
+            query_pos = query_embed.detach().unsqueeze(1)
+            self.register_buffer('tgt', tgt.clone())
+            self.register_buffer('qk', layer.multihead_attn.project_query(tgt + query_pos))  # (1, nhead, N, C)
+        # the modules keep their names in the decoder layer, e.g. for the attention capture
+        self.multihead_attn = layer.multihead_attn
+        self.norm2 = layer.norm2
+        self.linear1 = layer.linear1
+        self.activation = layer.activation
+        self.linear2 = layer.linear2
+        self.norm3 = layer.norm3
+
+    def forward(self, tgt, memory,
+                tgt_mask: Optional[Tensor] = None,
+                memory_mask: Optional[Tensor] = None,
+                tgt_key_padding_mask: Optional[Tensor] = None,
+                memory_key_padding_mask: Optional[Tensor] = None,
+                pos: Optional[Tensor] = None,
+                query_pos: Optional[Tensor] = None):
+        bs = memory.shape[1]
+        tgt = self.tgt.expand(-1, bs, -1)
+        # mutual attention, called through the module so that its hooks run
+        key = memory if pos is None else memory + pos
+        tgt2 = self.multihead_attn(None, key, memory, key_padding_mask=memory_key_padding_mask,
+                                   attn_mask=memory_mask, qk=self.qk.expand(bs, -1, -1, -1))[0]
+        tgt = self.norm2(tgt + tgt2)
+        tgt2 = self.linear2(self.activation(self.linear1(tgt)))
+        return self.norm3(tgt + tgt2)
+
+
+def fold_query_path(network: nn.Module):
+    """Simplify the query path of the decoder of a network in eval mode, in place:
+    the cross attention of every decoder layer becomes a QueryFoldedAttention, the first decoder layer a
+    ConstantQueryDecoderLayer and, with a single query, the self-attention of the other layers a
+    SingleTokenAttention. Only the post-norm decoder without divide_norm is supported."""
+    decoder = network.transformer.decoder
+    if decoder is None:
+        return network
+    if any(layer.normalize_before or layer.divide_norm for layer in decoder.layers):
+        raise ValueError("Folding the query path needs a post-norm decoder without divide_norm.")
+    for layer in decoder.layers[1:]:
+        layer.multihead_attn = QueryFoldedAttention(layer.multihead_attn)
+        if network.num_queries == 1:
+            layer.self_attn = SingleTokenAttention(layer.self_attn)
+    decoder.layers[0] = ConstantQueryDecoderLayer(decoder.layers[0], network.query_embed.weight)
+    return network
@@ -1,3 +1,4 @@
+import copy
 import torch.nn as nn
 import torch
 import torch.nn.functional as F
@@ -44,11 +45,11 @@ class Corner_Predictor(nn.Module):
         '''about coordinates and indexs'''
         with torch.no_grad():
             self.indice = torch.arange(0, self.feat_sz).view(-1, 1) * self.stride
-            # generate mesh-grid
-            self.coord_x = self.indice.repeat((self.feat_sz, 1)) \
-                .view((self.feat_sz * self.feat_sz,)).float().cuda()
-            self.coord_y = self.indice.repeat((1, self.feat_sz)) \
-                .view((self.feat_sz * self.feat_sz,)).float().cuda()
+            # generate mesh-grid (buffers follow the module across devices, not saved in checkpoints)
+            self.register_buffer('coord_x', self.indice.repeat((self.feat_sz, 1))
+                                 .view((self.feat_sz * self.feat_sz,)).float(), persistent=False)
+            self.register_buffer('coord_y', self.indice.repeat((1, self.feat_sz))
+                                 .view((self.feat_sz * self.feat_sz,)).float(), persistent=False)
 
     def forward(self, x):
         """ Forward pass with input x. """
@@ -82,6 +83,64 @@ class Corner_Predictor(nn.Module):
         return exp_x, exp_y
 
 
+class Corner_Predictor_Fused(nn.Module):
+    """ Inference-only Corner Predictor built from a trained one.
+    The top-left and bottom-right towers run as a single tower: the first conv produces the channels of
+    both branches and the following convs are grouped (groups=2), so that one softmax/expectation
+    gives all four coordinates. """
+    def __init__(self, predictor: Corner_Predictor):
+        super(Corner_Predictor_Fused, self).__init__()
+        self.feat_sz = predictor.feat_sz
+        self.stride = predictor.stride
+        self.img_sz = predictor.img_sz
+        self.conv1 = _fuse_branches(predictor.conv1_tl, predictor.conv1_br, groups=1)
+        self.conv2 = _fuse_branches(predictor.conv2_tl, predictor.conv2_br, groups=2)
+        self.conv3 = _fuse_branches(predictor.conv3_tl, predictor.conv3_br, groups=2)
+        self.conv4 = _fuse_branches(predictor.conv4_tl, predictor.conv4_br, groups=2)
+        self.conv5 = _fuse_branches(predictor.conv5_tl, predictor.conv5_br, groups=2)
+        # (HW, 2) grid of (x, y) coordinates
+        self.register_buffer('coord', torch.stack((predictor.coord_x, predictor.coord_y), dim=1), persistent=False)
+
+    def forward(self, x):
+        """ Forward pass with input x. """
+        score_map = self.conv5(self.conv4(self.conv3(self.conv2(self.conv1(x)))))  # (batch, 2, feat_sz, feat_sz)
+        prob_vec = nn.functional.softmax(
+            score_map.view((-1, 2, self.feat_sz * self.feat_sz)), dim=2)  # (batch, 2, feat_sz * feat_sz)
+        coord = torch.matmul(prob_vec, self.coord)  # (batch, 2, 2): (tl, br) x (x, y)
+        return coord.flatten(1) / self.img_sz
+
+
+def _fuse_branches(module_tl, module_br, groups):
+    """ Build one module computing module_tl and module_br side by side along the channel dimension. """
+    if isinstance(module_tl, nn.Sequential):
+        return nn.Sequential(*[_fuse_branches(m_tl, m_br, groups) for m_tl, m_br in zip(module_tl, module_br)])
+    if isinstance(module_tl, nn.Conv2d):
+        in_channels = module_tl.in_channels * groups
+        fused = nn.Conv2d(in_channels, 2 * module_tl.out_channels, kernel_size=module_tl.kernel_size,
+                          stride=module_tl.stride, padding=module_tl.padding, dilation=module_tl.dilation,
+                          groups=groups, bias=True)
+        with torch.no_grad():
+            fused.weight.copy_(torch.cat((module_tl.weight, module_br.weight), dim=0))
+            fused.bias.copy_(torch.cat((_conv_bias(module_tl), _conv_bias(module_br)), dim=0))
+        return fused
+    if isinstance(module_tl, (nn.BatchNorm2d, FrozenBatchNorm2d)):
+        if isinstance(module_tl, nn.BatchNorm2d):
+            fused = nn.BatchNorm2d(2 * module_tl.num_features, eps=module_tl.eps)
+        else:
+            fused = FrozenBatchNorm2d(2 * module_tl.weight.numel())
+        with torch.no_grad():
+            for name in ('weight', 'bias', 'running_mean', 'running_var'):
+                getattr(fused, name).copy_(torch.cat((getattr(module_tl, name), getattr(module_br, name)), dim=0))
+        return fused
+    if isinstance(module_tl, (nn.ReLU, nn.Identity)):
+        return copy.deepcopy(module_tl)
+    raise ValueError("Can not fuse module %s." % type(module_tl).__name__)
+
+
+def _conv_bias(conv):
+    return conv.bias if conv.bias is not None else conv.weight.new_zeros(conv.out_channels)
+
+
 class MLP(nn.Module):
     """ Very simple multi-layer perceptron (also called FFN)"""
 
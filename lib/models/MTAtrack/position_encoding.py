@@ -2,6 +2,8 @@
 Various positional encodings for the transformer.
 """
 import math
+from collections import OrderedDict
+
 import torch
 from torch import nn
 
@@ -26,11 +28,17 @@ class PositionEmbeddingSine(nn.Module):
 
     def forward(self, tensor_list: NestedTensor):
         x = tensor_list.tensors
-        mask = tensor_list.mask
-        assert mask is not None
-        not_mask = ~mask # (b,h,w)
-        y_embed = not_mask.cumsum(1, dtype=torch.float32)  # cumulative sum along axis 1 (h axis) --> (b, h, w)
-        x_embed = not_mask.cumsum(2, dtype=torch.float32)  # cumulative sum along axis 2 (w axis) --> (b, h, w)
+        if not getattr(tensor_list, 'padded', True):
+            # unpadded NestedRectTensor, the cumulative sums are the pixel indices, its mask is not built
+            b, _, h, w = x.size()
+            y_embed = torch.arange(1, h + 1, dtype=torch.float32, device=x.device)[None, :, None].expand(b, h, w)
+            x_embed = torch.arange(1, w + 1, dtype=torch.float32, device=x.device)[None, None, :].expand(b, h, w)
+        else:
+            mask = tensor_list.mask
+            assert mask is not None
+            not_mask = ~mask # (b,h,w)
+            y_embed = not_mask.cumsum(1, dtype=torch.float32)  # cumulative sum along axis 1 (h axis) --> (b, h, w)
+            x_embed = not_mask.cumsum(2, dtype=torch.float32)  # cumulative sum along axis 2 (w axis) --> (b, h, w)
         if self.normalize:
             eps = 1e-6
             y_embed = y_embed / (y_embed[:, -1:, :] + eps) * self.scale  # 2pi * (y / sigma(y))
@@ -89,6 +97,96 @@ class PositionEmbeddingNone(nn.Module):
         return torch.zeros((b, self.n_dim, h, w), device=x.device)  # (B, C, H, W)
 
 
+class PositionEmbeddingCache(nn.Module):
+    """
+    LRU memoization of a position embedding for inference.
+    The embedding of a sample only depends on the feature map size and on its padding mask, which at test time is
+    (almost) always the same rectangle, so the embeddings are stored per sample, keyed by the map size and the
+    unpadded rectangle of the sample. A batch mixing padded and unpadded crops reuses the entries of its samples
+    and the hits and misses are counted per sample. Samples whose mask is not rectangular are computed as usual
+    and not stored. The rectangles of a NestedRectTensor are used as they are, without reading the mask back from
+    the device.
+    """
+    def __init__(self, position_embedding, max_size=16):
+        super().__init__()
+        self.position_embedding = position_embedding
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def forward(self, tensor_list: NestedTensor):
+        if self.training:
+            # the learned embedding changes during training
+            return self.position_embedding(tensor_list)
+        keys = self._get_keys(tensor_list)
+        cached = [self.cache.get(key) if key is not None else None for key in keys]
+        for key, pos in zip(keys, cached):
+            if pos is not None:
+                self.cache.move_to_end(key)
+        num_hits = sum(pos is not None for pos in cached)
+        self.hits += num_hits
+        self.misses += len(keys) - num_hits
+        if num_hits < len(keys):
+            # the missing samples are computed with the whole batch
+            pos = self.position_embedding(tensor_list)
+            for i, key in enumerate(keys):
+                if cached[i] is None:
+                    # a single sample is stored as it is, the slices of a batch are copied not to hold it
+                    cached[i] = pos if len(keys) == 1 else pos[i:i + 1].clone()
+                    if key is not None and key not in self.cache:
+                        self.cache[key] = cached[i]
+                        if len(self.cache) > self.max_size:
+                            self.cache.popitem(last=False)
+            if num_hits == 0:
+                return pos
+        return cached[0] if len(cached) == 1 else torch.cat(cached, dim=0)
+
+    def _get_keys(self, tensor_list: NestedTensor):
+        """Key of every sample, None for the samples that are not cached."""
+        x = tensor_list.tensors
+        b, _, h, w = x.size()
+        if not isinstance(self.position_embedding, PositionEmbeddingSine):
+            # learned and none embeddings do not look at the mask
+            return [(h, w, x.device)] * b
+        rects = getattr(tensor_list, 'rects', None)  # NestedRectTensor, the rectangles are already on the host
+        if rects is None:
+            rects = self._get_rects(tensor_list.mask)
+        return [(h, w, x.device, tuple(rect)) if rect is not None else None for rect in rects]
+
+    @staticmethod
+    def _get_rects(mask):
+        """Describe the mask by the unpadded rectangle (x0, y0, x1, y1) of every sample, None for a sample whose
+        mask is not one."""
+        not_mask = ~mask
+        rows = not_mask.any(2)  # (b,h)
+        cols = not_mask.any(1)  # (b,w)
+        is_rect = (not_mask == (rows[:, :, None] & cols[:, None, :])).flatten(1).all(1, keepdim=True)
+        # a single device to host copy for all the keys
+        rows_cols = torch.cat((rows, cols, is_rect), dim=1).cpu().tolist()
+        h = rows.shape[1]
+        rects = []
+        for rc in rows_cols:
+            y0, y1 = _get_span(rc[:h])
+            x0, x1 = _get_span(rc[h:-1])
+            if not rc[-1] or y0 is None or x0 is None:
+                rects.append(None)
+            else:
+                rects.append((x0, y0, x1, y1))
+        return rects
+
+    def stats(self):
+        return {"pos_cache_hits": self.hits, "pos_cache_misses": self.misses}
+
+
+def _get_span(flags):
+    """Return the [start, end) span of a contiguous run of True values, (None, None) otherwise."""
+    idx = [i for i, f in enumerate(flags) if f]
+    if len(idx) == 0 or idx[-1] - idx[0] + 1 != len(idx):
+        return None, None
+    return idx[0], idx[-1] + 1
+
+
 def build_position_encoding(cfg):
     N_steps = cfg.MODEL.HIDDEN_DIM // 2
     if cfg.MODEL.POSITION_EMBEDDING in ('v2', 'sine'):
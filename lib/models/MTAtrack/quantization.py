@@ -0,0 +1,81 @@
+"""
+Int8 quantization of a trained MTAtrack network for cpu inference.
+"""
+import copy
+
+import torch
+from torch import nn
+
+from .head import MLP
+
+
+def quantize_dynamic_int8(network: nn.Module):
+    """
+    Dynamic int8 quantization of the nn.Linear layers of the transformer (linear1/linear2 of every encoder
+    and decoder layer) and of the MLP heads, in place. Weights are quantized once, activations are quantized
+    on the fly, so no calibration is needed. Modules that are not plain nn.Linear (e.g. the projections of
+    nn.MultiheadAttention) are left in float, the projections of InferenceMultiheadAttention are quantized.
+    """
+    spec = {nn.Linear}
+    network.transformer = torch.quantization.quantize_dynamic(network.transformer, spec, dtype=torch.qint8,
+                                                               inplace=True)
+    if getattr(network, 'cls_head', None) is not None:
+        network.cls_head = torch.quantization.quantize_dynamic(network.cls_head, spec, dtype=torch.qint8,
+                                                                inplace=True)
+    if isinstance(network.box_head, MLP):
+        network.box_head = torch.quantization.quantize_dynamic(network.box_head, spec, dtype=torch.qint8,
+                                                                inplace=True)
+    return network
+
+
+def prepare_backbone_static(body: nn.Module, example_input: torch.Tensor):
+    """
+    Prepare the ResNet body of the backbone (the IntermediateLayerGetter up to layer3) for static post-training
+    int8 quantization. The returned module records activation ranges while calibration crops are run through it.
+    Batch norms should be folded beforehand (see fusion.fold_batchnorm), prepare_fx does not fuse the frozen norms.
+    The nn.Identity left in their place are dropped from the graph so that the conv+relu pairs get fused.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    body = drop_identities(copy.deepcopy(body).eval())
+    return prepare_fx(body, qconfig_mapping, example_inputs=(example_input,))
+
+
+def drop_identities(module: nn.Module):
+    """Symbolically traced copy of a module without its nn.Identity calls."""
+    from torch.fx import symbolic_trace
+    graph_module = symbolic_trace(module)
+    modules = dict(graph_module.named_modules())
+    for node in list(graph_module.graph.nodes):
+        if node.op == 'call_module' and isinstance(modules[node.target], nn.Identity):
+            node.replace_all_uses_with(node.args[0])
+            graph_module.graph.erase_node(node)
+    graph_module.graph.lint()
+    graph_module.delete_all_unused_submodules()
+    graph_module.recompile()
+    return graph_module
+
+
+def convert_backbone_static(prepared_body: nn.Module):
+    """Convert a calibrated body returned by prepare_backbone_static to int8. Raise when no conv+relu pair was
+    fused, every relu would then run between a dequantize and a quantize."""
+    from torch.ao.quantization.quantize_fx import convert_fx
+    quantized_body = convert_fx(prepared_body)
+    if count_fused_conv_relu(quantized_body) == 0:
+        raise ValueError("No conv+relu pair of the backbone was fused, are the batch norms folded?")
+    return quantized_body
+
+
+def count_fused_conv_relu(quantized_body: nn.Module):
+    """Number of fused int8 conv+relu modules (ConvReLU2d) of a converted body."""
+    return sum(type(m).__name__ == 'ConvReLU2d' for m in quantized_body.modules())
+
+
+def save_quantized_backbone(quantized_body: nn.Module, path: str):
+    """Save the int8 body as a TorchScript artifact, so that trackers load it without calibrating again."""
+    torch.jit.save(torch.jit.script(quantized_body), path)
+
+
+def load_quantized_backbone(path: str):
+    return torch.jit.load(path, map_location='cpu').eval()
@@ -30,19 +30,8 @@ def check_valid(tensor, type_name):
     if check_nan(tensor):
         print("%s is nan" % type_name)
 
-# def pltshow(pred_map, name):
-#        import matplotlib.pyplot as plt
-#        plt.figure(2)
-#        pred_frame = plt.gca()
-#        plt.imshow(pred_map, 'jet')
-#        pred_frame.axes.get_yaxis().set_visible(False)
-#        pred_frame.axes.get_xaxis().set_visible(False)
-#        pred_frame.spines['top'].set_visible(False)
-#        pred_frame.spines['bottom'].set_visible(False)
-#        pred_frame.spines['left'].set_visible(False)
-#        pred_frame.spines['right'].set_visible(False)
-#        plt.savefig(pred_name, bbox_inches='tight', pad_inches=0, dpi=150)
-#        plt.close(2)
+
+# attention maps are captured with lib.models.MTAtrack.attention.AttentionCapture
 
 class Transformer(nn.Module):
 
@@ -77,6 +66,8 @@ class Transformer(nn.Module):
 
         self.divide_norm = divide_norm
         self.scale_factor = float(d_model // nhead) ** 0.5
+        # encoder layers whose outputs are returned together with the decoder output
+        self.enc_output_layers = (0, 5)
 
     def _reset_parameters(self):
         for p in self.parameters():
@@ -90,11 +81,13 @@ class Transformer(nn.Module):
         :param mask: (bs, H1W1+H2W2)
         :param query_embed: (N, C) or (N, B, C)
         :param pos_embed: (H1W1+H2W2, bs, C)
-        :param mode: run the whole transformer or encoder only
+        :param mode: run the whole transformer, encoder only, or the whole transformer with interleaved layers
         :param return_encoder_output: whether to return the output of encoder (together with decoder)
         :return:
         """
-        assert mode in ["all", "encoder"]
+        assert mode in ["all", "encoder", "interleave"]
+        if mode == "interleave":
+            return self.forward_interleave(feat, mask, query_embed, pos_embed, return_encoder_output)
         if self.encoder is None:
             memory = feat
         else:
@@ -114,10 +107,38 @@ class Transformer(nn.Module):
                 hs = query_embed.unsqueeze(0)
             if return_encoder_output:
                 # return hs.transpose(1, 2), memory[0], memory[5] # (1, B, N, C)  ##返回hs 和memory
-                return hs.transpose(1, 2), memory[0], memory[5] # (1, B, N, C)  ##返回hs 和memory
+                return (hs.transpose(1, 2),) + tuple(memory[i] for i in self.enc_output_layers) # (1, B, N, C)  ##返回hs 和memory
             else:
                 return hs.transpose(1, 2) # (1, B, N, C)
 
+    def forward_interleave(self, feat, mask, query_embed, pos_embed, return_encoder_output=False):
+        """
+        Inference execution of the whole transformer that runs decoder layer i right after encoder layer i.
+        Only the encoder outputs listed in enc_output_layers are kept, every other layer output is released
+        as soon as its decoder layer has consumed it. The results are the same as mode="all".
+        """
+        assert self.encoder is not None and self.decoder is not None
+        assert self.encoder.num_layers == self.decoder.num_layers and not self.decoder.return_intermediate
+        assert len(query_embed.size()) in [2, 3]
+        if len(query_embed.size()) == 2:
+            bs = feat.size(1)
+            query_embed = query_embed.unsqueeze(1).repeat(1, bs, 1)  # (N,C) --> (N,1,C) --> (N,B,C)
+        tgt = torch.zeros_like(query_embed)
+        memory = feat
+        enc_output = {}
+        for i, (enc_layer, dec_layer) in enumerate(zip(self.encoder.layers, self.decoder.layers)):
+            memory = enc_layer(memory, src_key_padding_mask=mask, pos=pos_embed)
+            tgt = dec_layer(tgt, memory, memory_key_padding_mask=mask, pos=pos_embed, query_pos=query_embed)
+            if i in self.enc_output_layers:
+                enc_output[i] = memory
+        if self.decoder.norm is not None:
+            tgt = self.decoder.norm(tgt)
+        hs = tgt.unsqueeze(0)
+        if return_encoder_output:
+            return (hs.transpose(1, 2),) + tuple(enc_output[i] for i in self.enc_output_layers) # (1, B, N, C)
+        else:
+            return hs.transpose(1, 2) # (1, B, N, C)
+
 
 class TransformerEncoder(nn.Module):
 
@@ -134,13 +155,10 @@ class TransformerEncoder(nn.Module):
         output = src
 
         memory = []
-        # i = 1
         for layer in self.layers:
             output = layer(output, src_mask=mask,
                            src_key_padding_mask=src_key_padding_mask, pos=pos)
             memory.append(output)
-            # pltshow(attn_map, 'search-search_{0}'.format(i))
-            # i=i+1
 
         if self.norm is not None:
             output = self.norm(output)
@@ -231,10 +249,8 @@ class TransformerEncoderLayer(nn.Module):
             q = q / torch.norm(q, dim=-1, keepdim=True) * self.scale_factor
             k = k / torch.norm(k, dim=-1, keepdim=True)
         src2 = self.self_attn(q, k, value=src, attn_mask=src_mask,
-                              key_padding_mask=src_key_padding_mask)[0]
+                              key_padding_mask=src_key_padding_mask, need_weights=False)[0]
         
-        # attn_map = attn_map[0,0:64,0:64]  #[bn,400,400]
-        # attn_map = attn_map.cpu().data.numpy().reshape(64,8,8)[28]
         
 
         src = src + self.dropout1(src2)
@@ -251,7 +267,7 @@ class TransformerEncoderLayer(nn.Module):
         src2 = self.norm1(src)
         q = k = self.with_pos_embed(src2, pos)
         src2 = self.self_attn(q, k, value=src2, attn_mask=src_mask,
-                              key_padding_mask=src_key_padding_mask)[0]
+                              key_padding_mask=src_key_padding_mask, need_weights=False)[0]
         src = src + self.dropout1(src2)
         src2 = self.norm2(src)
         src2 = self.linear2(self.dropout(self.activation(self.linear1(src2))))
@@ -308,7 +324,7 @@ class TransformerDecoderLayer(nn.Module):
             q = q / torch.norm(q, dim=-1, keepdim=True) * self.scale_factor
             k = k / torch.norm(k, dim=-1, keepdim=True)
         tgt2 = self.self_attn(q, k, value=tgt, attn_mask=tgt_mask,
-                              key_padding_mask=tgt_key_padding_mask)[0]
+                              key_padding_mask=tgt_key_padding_mask, need_weights=False)[0]
         tgt = tgt + self.dropout1(tgt2)
         tgt = self.norm1(tgt)
         # mutual attention
@@ -319,7 +335,7 @@ class TransformerDecoderLayer(nn.Module):
         tgt2 = self.multihead_attn(query=queries,
                                    key=keys,
                                    value=memory, attn_mask=memory_mask,
-                                   key_padding_mask=memory_key_padding_mask)[0]
+                                   key_padding_mask=memory_key_padding_mask, need_weights=False)[0]
         tgt = tgt + self.dropout2(tgt2)
         tgt = self.norm2(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt))))
@@ -337,13 +353,13 @@ class TransformerDecoderLayer(nn.Module):
         tgt2 = self.norm1(tgt)
         q = k = self.with_pos_embed(tgt2, query_pos)
         tgt2 = self.self_attn(q, k, value=tgt2, attn_mask=tgt_mask,
-                              key_padding_mask=tgt_key_padding_mask)[0]
+                              key_padding_mask=tgt_key_padding_mask, need_weights=False)[0]
         tgt = tgt + self.dropout1(tgt2)
         tgt2 = self.norm2(tgt)
         tgt2 = self.multihead_attn(query=self.with_pos_embed(tgt2, query_pos),
                                    key=self.with_pos_embed(memory, pos),
                                    value=memory, attn_mask=memory_mask,
-                                   key_padding_mask=memory_key_padding_mask)[0]
+                                   key_padding_mask=memory_key_padding_mask, need_weights=False)[0]
         tgt = tgt + self.dropout2(tgt2)
         tgt2 = self.norm3(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
@@ -0,0 +1,74 @@
+"""
+Flat inference weight file of a trained MTAtrack network.
+Only the state dict of the network is kept (no optimizer state, no pickled objects): a small json header describing
+the tensors followed by their raw data, each tensor aligned so that it can be used in place from a memory map.
+Trackers map the file instead of unpickling the training checkpoint, so the workers of a node share the pages of the
+file through the page cache and start without reading the whole checkpoint.
+"""
+import json
+import struct
+
+import numpy as np
+import torch
+
+MAGIC = b"MTAW"
+VERSION = 1
+ALIGNMENT = 64
+# magic, version, header length
+_PREAMBLE = struct.Struct("<4sIQ")
+
+_DTYPES = {torch.float32: "float32", torch.float16: "float16", torch.float64: "float64", torch.int64: "int64",
+           torch.int32: "int32", torch.uint8: "uint8", torch.bool: "bool"}
+
+
+def _align(offset: int):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_flat_weights(state_dict: dict, path: str, fp16=False):
+    """Write a state dict to a flat weight file. With fp16 the floating point tensors are stored in half precision,
+    which halves the file but makes load_flat_weights cast them back to float32 in private memory."""
+    arrays, tensors = {}, {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu()
+        if fp16 and tensor.is_floating_point():
+            tensor = tensor.half()
+        if tensor.dtype not in _DTYPES:
+            raise ValueError("Unsupported dtype %s of %s" % (tensor.dtype, name))
+        arrays[name] = tensor.contiguous().numpy()
+        tensors[name] = {"dtype": _DTYPES[tensor.dtype], "shape": list(tensor.shape), "offset": offset}
+        offset = _align(offset + arrays[name].nbytes)
+    header = json.dumps({"tensors": tensors}).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + tensors[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    return path
+
+
+def load_flat_weights(path: str):
+    """Map a flat weight file and return its state dict. The float32 tensors are views of the map (copy-on-write,
+    the file is never written), load them with load_state_dict(..., assign=True) to keep them shared."""
+    with open(path, "rb") as f:
+        magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a flat weight file of version %d" % (path, VERSION))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    data_start = _align(_PREAMBLE.size + header_len)
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+    state_dict = {}
+    for name, info in header["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"], dtype=np.int64))
+        start = data_start + info["offset"]
+        array = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+        tensor = torch.from_numpy(array)
+        if tensor.dtype == torch.float16:
+            tensor = tensor.float()
+        state_dict[name] = tensor
+    return state_dict
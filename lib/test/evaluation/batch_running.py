@@ -0,0 +1,86 @@
+import sys
+import time
+from collections import deque
+from lib.test.evaluation import Sequence, Tracker
+from lib.test.evaluation.running import _save_tracker_output, _results_exist
+from lib.test.tracker.MTAtrack_batch import BatchedMTAtrack
+
+
+class _SlotSequence(object):
+    """A sequence being tracked in a slot of the batch and its outputs so far."""
+    def __init__(self, seq: Sequence, init_bbox: list, init_time: float):
+        self.seq = seq
+        self.frame_num = 1
+        self.output = {'target_bbox': [init_bbox], 'time': [init_time]}
+
+    def done(self):
+        return self.frame_num >= len(self.seq.frames)
+
+
+def _finish_sequence(slot_seq: _SlotSequence, tracker: Tracker, debug=False):
+    output = slot_seq.output
+    if len(output['target_bbox']) <= 1:
+        output.pop('target_bbox')
+    print('Tracker: {} {} {} ,  Sequence: {}'.format(tracker.name, tracker.parameter_name, tracker.run_id,
+                                                      slot_seq.seq.name))
+    print('FPS: {}'.format(len(output['time']) / sum(output['time'])))
+    sys.stdout.flush()
+    if not debug:
+        _save_tracker_output(slot_seq.seq, tracker, output)
+
+
+def run_dataset_batched(dataset, tracker: Tracker, batch_size=8, debug=False):
+    """Runs a tracker on a dataset, batch_size sequences at a time in lock step on one network.
+    Every frame step tracks the next frame of all the sequences in the batch with one backbone and one transformer
+    call; a slot whose sequence ended takes the next pending sequence before the following step. The time of a step
+    is split evenly between the frames it tracked.
+    args:
+        dataset: List of Sequence instances, forming a dataset.
+        tracker: Tracker instance of MTAtrack_s or MTAtrack_st.
+        batch_size: Number of sequences tracked together.
+        debug: Debug level.
+    """
+    pending = deque(seq for seq in dataset if debug or not _results_exist(seq, tracker))
+    print('Evaluating {} {} on {:5d} sequences, {} at a time'.format(tracker.name, tracker.parameter_name,
+                                                                       len(pending), batch_size))
+    base_tracker = tracker.get_tracker()
+    bgr = base_tracker.expects_bgr_input()
+    batched = BatchedMTAtrack(base_tracker, batch_size)
+    slots = [None] * batch_size
+
+    while True:
+        # give the free slots to the next sequences
+        for b in range(batch_size):
+            while slots[b] is None and pending:
+                seq = pending.popleft()
+                if seq.object_ids is not None:
+                    raise ValueError("Batched tracking only supports single object sequences.")
+                init_bbox = seq.init_info().get('init_bbox')
+                image = tracker._read_image(seq.frames[0], bgr)
+                start_time = time.time()
+                batched.initialize(b, image, init_bbox)
+                slot_seq = _SlotSequence(seq, init_bbox, time.time() - start_time)
+                if slot_seq.done():
+                    _finish_sequence(slot_seq, tracker, debug)
+                else:
+                    slots[b] = slot_seq
+        active = [b for b in range(batch_size) if slots[b] is not None]
+        if not active:
+            break
+
+        images = {b: tracker._read_image(slots[b].seq.frames[slots[b].frame_num], bgr) for b in active}
+        start_time = time.time()
+        outputs = batched.track(images)
+        frame_time = (time.time() - start_time) / len(active)
+        for b in active:
+            slot_seq = slots[b]
+            slot_seq.output['target_bbox'].append(outputs[b]['target_bbox'])
+            slot_seq.output['time'].append(frame_time)
+            slot_seq.frame_num += 1
+            if slot_seq.done():
+                _finish_sequence(slot_seq, tracker, debug)
+                slots[b] = None
+
+    for name, val in batched.engine.get_stats().items():
+        print('{}: {}'.format(name, val))
+    print('Done')
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from lib.test.tracker.MTAtrack_batch import BatchedMTAtrack
+
+
+class MultiObjectWrapper:
+    """Tracks several targets in the same video with the network of one MTAtrack tracker.
+    Every object id gets a slot of a BatchedMTAtrack holding its templates and state, and each frame is tracked with
+    one backbone and one transformer call for all the targets. Objects can be added in any frame through
+    info['init_object_ids'] and info['init_bbox'], the number of slots grows with them.
+    The outputs are OrderedDicts keyed by object id, the format _save_tracker_output writes per object.
+    args:
+        tracker: MTAtrack_S or MTAtrack_ST instance whose network is shared by all the targets.
+    """
+    def __init__(self, tracker, initial_slots=4):
+        self.tracker = tracker
+        self.params = tracker.params
+        self.visdom = None
+        self.batched = BatchedMTAtrack(tracker, initial_slots)
+        self.slots = OrderedDict()  # object id --> slot
+
+    def predicts_segmentation_mask(self):
+        return False
+
+    def expects_bgr_input(self):
+        return self.tracker.expects_bgr_input()
+
+    def reset(self):
+        self.slots = OrderedDict()
+
+    def initialize(self, image, info: dict) -> dict:
+        self.reset()
+        return {'target_bbox': self._add_objects(image, info)}
+
+    def track(self, image, info: dict = None) -> dict:
+        images = {slot: image for slot in self.slots.values()}
+        outputs = self.batched.track(images) if images else {}
+        out = {'target_bbox': OrderedDict((obj_id, outputs[slot]['target_bbox'])
+                                          for obj_id, slot in self.slots.items())}
+        if any('conf_score' in o for o in outputs.values()):
+            out['conf_score'] = OrderedDict((obj_id, outputs[slot]['conf_score'])
+                                            for obj_id, slot in self.slots.items())
+        # targets appearing in this frame start tracking from the next one
+        if info is not None and info.get('init_object_ids') is not None:
+            out['target_bbox'].update(self._add_objects(image, info))
+        return out
+
+    def get_stats(self) -> dict:
+        return self.tracker.get_stats()
+
+    def _add_objects(self, image, info: dict):
+        """Initialize the targets of info, a single box without object ids is object 1."""
+        init_bbox = info['init_bbox']
+        if not isinstance(init_bbox, (dict, OrderedDict)):
+            init_bbox = OrderedDict({1: init_bbox})
+        object_ids = info.get('init_object_ids', list(init_bbox.keys()))
+        num_slots = len(self.slots) + len(object_ids)
+        if num_slots > self.batched.batch_size:
+            self.batched.resize(max(num_slots, 2 * self.batched.batch_size))
+        added = OrderedDict()
+        for obj_id in object_ids:
+            slot = self.slots.get(obj_id, len(self.slots))
+            self.batched.initialize(slot, image, init_bbox[obj_id])
+            self.slots[obj_id] = slot
+            added[obj_id] = init_bbox[obj_id]
+        return added
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _frame_key(frame, bgr: bool):
+    """Hashable key of a frame entry, a path or [lmdb_path, key], read in a color order."""
+    return (tuple(frame) if isinstance(frame, list) else frame), bgr
+
+
+class FramePrefetcher(object):
+    """Decodes the frames of a sequence on a thread pool ahead of the tracker.
+    At most depth frames are queued or being decoded, in the order the tracker reads them. Once the frames of the
+    current sequence are all submitted, the first frames of the sequence given to prefetch() take their place, so
+    the next sequence starts without waiting for the disk. cv.imread and the lmdb decoding release the GIL, the
+    workers run while the network does. With depth or workers 0 the frames are read when asked for.
+    The time the tracker waits for its frames (the whole decoding when nothing is prefetched) is reported by
+    get_stats() for the current sequence.
+    args:
+        read_fn: read_fn(frame, bgr) returns the image of a frame entry, a path or [lmdb_path, key].
+        depth: Number of frames decoded ahead.
+        workers: Number of decoding threads.
+    """
+    def __init__(self, read_fn, depth=8, workers=2):
+        self.read_fn = read_fn
+        self.depth = depth if workers > 0 else 0
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers) if self.depth > 0 else None
+        self.inflight = OrderedDict()  # frame key --> future
+        self.current = deque()  # (frame, bgr) of the current sequence not submitted yet
+        self.upcoming = deque()  # (frame, bgr) of the next sequence not submitted yet
+        self.wait_time = 0.0
+        self.num_frames = 0
+
+    def start(self, frames: list, bgr=False):
+        """Start reading the frames of a new sequence, the frames of other sequences in flight are dropped."""
+        queued = [(frame, bgr) for frame in frames]
+        keys = set(_frame_key(frame, bgr) for frame, bgr in queued[:self.depth])
+        for key in list(self.inflight.keys()):
+            if key not in keys:
+                # a frame being decoded finishes in the background, its result is discarded
+                self.inflight.pop(key).cancel()
+        self.current = deque(entry for entry in queued if _frame_key(*entry) not in self.inflight)
+        self.upcoming = deque()
+        self.wait_time = 0.0
+        self.num_frames = 0
+        self._fill()
+
+    def prefetch(self, frames: list, bgr=False):
+        """Decode the first frames of the next sequence after the frames of the current one."""
+        self.upcoming = deque((frame, bgr) for frame in frames[:self.depth])
+        self._fill()
+
+    def read(self, frame, bgr=False):
+        """Image of a frame of the current sequence, frames are expected in the order given to start()."""
+        key = _frame_key(frame, bgr)
+        start_time = time.time()
+        if key in self.inflight:
+            image = self.inflight.pop(key).result()
+        else:
+            image = self.read_fn(frame, bgr)
+        self.wait_time += time.time() - start_time
+        self.num_frames += 1
+        self._fill()
+        return image
+
+    def get_stats(self) -> dict:
+        return {"decode_wait": self.wait_time,
+                "decode_wait_per_frame": self.wait_time / max(self.num_frames, 1)}
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.inflight.clear()
+
+    def _fill(self):
+        if self.executor is None:
+            return
+        while len(self.inflight) < self.depth and (self.current or self.upcoming):
+            frame, bgr = (self.current or self.upcoming).popleft()
+            key = _frame_key(frame, bgr)
+            if key not in self.inflight:
+                self.inflight[key] = self.executor.submit(self.read_fn, frame, bgr)
@@ -99,8 +99,22 @@ def _save_tracker_output(seq: Sequence, tracker: Tracker, output: dict):
                 save_time(timings_file, data)
 
 
-def run_sequence(seq: Sequence, tracker: Tracker, debug=False, num_gpu=8):
-    """Runs a tracker on a sequence."""
+def _results_exist(seq: Sequence, tracker: Tracker):
+    if seq.object_ids is None:
+        if seq.dataset in ['trackingnet', 'got10k']:
+            base_results_path = os.path.join(tracker.results_dir, seq.dataset, seq.name)
+            bbox_file = '{}.txt'.format(base_results_path)
+        else:
+            bbox_file = '{}/{}.txt'.format(tracker.results_dir, seq.name)
+        return os.path.isfile(bbox_file)
+    else:
+        bbox_files = ['{}/{}_{}.txt'.format(tracker.results_dir, seq.name, obj_id) for obj_id in seq.object_ids]
+        missing = [not os.path.isfile(f) for f in bbox_files]
+        return sum(missing) == 0
+
+
+def run_sequence(seq: Sequence, tracker: Tracker, debug=False, num_gpu=8, next_seq: Sequence = None):
+    """Runs a tracker on a sequence, the first frames of next_seq are decoded while it runs."""
     '''2021.1.2 Add multiple gpu support'''
     try:
         worker_name = multiprocessing.current_process().name
@@ -110,30 +124,17 @@ def run_sequence(seq: Sequence, tracker: Tracker, debug=False, num_gpu=8):
     except:
         pass
 
-    def _results_exist():
-        if seq.object_ids is None:
-            if seq.dataset in ['trackingnet', 'got10k']:
-                base_results_path = os.path.join(tracker.results_dir, seq.dataset, seq.name)
-                bbox_file = '{}.txt'.format(base_results_path)
-            else:
-                bbox_file = '{}/{}.txt'.format(tracker.results_dir, seq.name)
-            return os.path.isfile(bbox_file)
-        else:
-            bbox_files = ['{}/{}_{}.txt'.format(tracker.results_dir, seq.name, obj_id) for obj_id in seq.object_ids]
-            missing = [not os.path.isfile(f) for f in bbox_files]
-            return sum(missing) == 0
-
-    if _results_exist() and not debug:
+    if _results_exist(seq, tracker) and not debug:
         print('FPS: {}'.format(-1))
         return
 
     print('Tracker: {} {} {} ,  Sequence: {}'.format(tracker.name, tracker.parameter_name, tracker.run_id, seq.name))
 
     if debug:
-        output = tracker.run_sequence(seq, debug=debug)
+        output = tracker.run_sequence(seq, debug=debug, next_seq=next_seq)
     # else:
     #     try:
-    output = tracker.run_sequence(seq, debug=debug)     #debug    default = 0   !!!!   用到了 out = tracker.initialize(image, init_info)
+    output = tracker.run_sequence(seq, debug=debug, next_seq=next_seq)     #debug    default = 0   !!!!   用到了 out = tracker.initialize(image, init_info)
         # except Exception as e:
         #     print(e)
         #     return
@@ -153,6 +154,10 @@ def run_sequence(seq: Sequence, tracker: Tracker, debug=False, num_gpu=8):
         _save_tracker_output(seq, tracker, output)
 
 
+def _run_sequence_args(args):
+    return run_sequence(*args)
+
+
 def run_dataset(dataset, trackers, debug=False, threads=0, num_gpus=8):
     """Runs a list of trackers on a dataset.
     args:
@@ -173,11 +178,16 @@ def run_dataset(dataset, trackers, debug=False, threads=0, num_gpus=8):
         mode = 'parallel'  #多进程
 
     if mode == 'sequential':
-        for seq in dataset:
-            for tracker_info in trackers:
-                run_sequence(seq, tracker_info, debug=debug)
+        runs = list(product(dataset, trackers))
+        # the sequence tracked after each run, skipping the runs whose results exist
+        pending = [i for i, (seq, tracker_info) in enumerate(runs) if debug or not _results_exist(seq, tracker_info)]
+        next_seqs = {i: runs[j][0] for i, j in zip(pending, pending[1:])}
+        for i, (seq, tracker_info) in enumerate(runs):
+            run_sequence(seq, tracker_info, debug=debug, next_seq=next_seqs.get(i))
     elif mode == 'parallel':
+        # the workers live for the whole run and pull one sequence at a time, each builds its trackers once
         param_list = [(seq, tracker_info, debug, num_gpus) for seq, tracker_info in product(dataset, trackers)]
         with multiprocessing.Pool(processes=threads) as pool:
-            pool.starmap(run_sequence, param_list)
+            for _ in pool.imap_unordered(_run_sequence_args, param_list, chunksize=1):
+                pass
     print('Done')
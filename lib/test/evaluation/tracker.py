@@ -2,13 +2,28 @@ import importlib
 import os
 from collections import OrderedDict
 from lib.test.evaluation.environment import env_settings
+from lib.test.evaluation.multi_object_wrapper import MultiObjectWrapper
+from lib.test.evaluation.prefetch import FramePrefetcher
 import time
 import cv2 as cv
 
-from lib.utils.lmdb_utils import decode_img
+from lib.utils.lmdb_utils import decode_img, get_lmdb_handle
 from pathlib import Path
 import numpy as np
 
+# trackers built in this process, reused across sequences (see Tracker.get_tracker)
+_tracker_cache = {}
+# frame decoding threads of this process, shared by the trackers (see Tracker.get_prefetcher)
+_prefetchers = {}
+
+
+def _decode_img_bgr(lmdb_fname, key_name):
+    """decode_img without the conversion to RGB."""
+    binfile = get_lmdb_handle(lmdb_fname).get(key_name.encode())
+    if binfile is None:
+        raise ValueError("Illegal data detected. %s %s" % (lmdb_fname, key_name))
+    return cv.imdecode(np.frombuffer(binfile, np.uint8), cv.IMREAD_COLOR)
+
 
 def trackerlist(name: str, parameter_name: str, dataset_name: str, run_ids = None, display_name: str = None,
                 result_only=False):
@@ -31,10 +46,11 @@ class Tracker:
         parameter_name: Name of parameter file.
         run_id: The run id.
         display_name: Name to be displayed in the result plots.
+        param_overrides: Dict of tracker params replacing the values set by the parameter file.
     """
 
     def __init__(self, name: str, parameter_name: str, dataset_name: str, run_id: int = None, display_name: str = None,
-                 result_only=False):
+                 result_only=False, param_overrides: dict = None):
         assert run_id is None or isinstance(run_id, int)
 
         self.name = name
@@ -42,6 +58,7 @@ class Tracker:
         self.dataset_name = dataset_name
         self.run_id = run_id
         self.display_name = display_name
+        self.param_overrides = {} if param_overrides is None else param_overrides
 
         env = env_settings()
         if self.run_id is None:
@@ -63,15 +80,38 @@ class Tracker:
         tracker = self.tracker_class(params, self.dataset_name)
         return tracker
 
-    def run_sequence(self, seq, debug=None):
+    def get_tracker(self):
+        """Tracker of this process for these settings, the parameters are read and the network is built on the
+        first call only. The tracker is reset, ready to be initialized on a new sequence."""
+        key = (self.name, self.parameter_name, self.dataset_name, repr(sorted(self.param_overrides.items())))
+        if key not in _tracker_cache:
+            _tracker_cache[key] = self.create_tracker(self.get_parameters())
+        tracker = _tracker_cache[key]
+        tracker.reset()
+        return tracker
+
+    def get_prefetcher(self, params):
+        """Frame prefetcher of this process for the prefetch_depth and prefetch_workers of the tracker params,
+        reading nothing ahead when the tracker does not set them."""
+        key = (params.get('prefetch_depth', 0), params.get('prefetch_workers', 0))
+        if key not in _prefetchers:
+            _prefetchers[key] = FramePrefetcher(self._read_image, *key)
+        return _prefetchers[key]
+
+    def run_sequence(self, seq, debug=None, next_seq=None):
         """Run tracker on sequence.
         args:
             seq: Sequence to run the tracker on.
             visualization: Set visualization flag (None means default value specified in the parameters).
             debug: Set debug level (None means default value specified in the parameters).
             multiobj_mode: Which mode to use for multiple objects.
+            next_seq: Sequence run next in this process, its first frames are decoded while seq is tracked.
         """
-        params = self.get_parameters()
+        tracker = self.get_tracker()
+        params = tracker.params
+        if seq.multiobj_mode:
+            # all the targets of the sequence are tracked together on the network of the tracker
+            tracker = MultiObjectWrapper(tracker)
 
         debug_ = debug
         if debug is None:
@@ -82,12 +122,14 @@ class Tracker:
         # Get init information
         init_info = seq.init_info()
 
-        tracker = self.create_tracker(params)
+        prefetcher = self.get_prefetcher(params)
+        output = self._track_sequence(tracker, seq, init_info, prefetcher, next_seq)
 
-        output = self._track_sequence(tracker, seq, init_info)
+        for name, val in dict(tracker.get_stats(), **prefetcher.get_stats()).items():
+            print('{}: {}'.format(name, val))
         return output
 
-    def _track_sequence(self, tracker, seq, init_info):
+    def _track_sequence(self, tracker, seq, init_info, prefetcher: FramePrefetcher, next_seq=None):
         # Define outputs
         # Each field in output is a list containing tracker prediction for each frame.
 
@@ -115,7 +157,12 @@ class Tracker:
                     output[key].append(val)
 
         # Initialize
-        image = self._read_image(seq.frames[0])
+        bgr = tracker.expects_bgr_input()
+        # the frames are decoded on the threads of the prefetcher while the tracker runs
+        prefetcher.start(seq.frames, bgr)
+        if next_seq is not None:
+            prefetcher.prefetch(next_seq.frames, bgr)
+        image = prefetcher.read(seq.frames[0], bgr)
         start_time = time.time()
         out = tracker.initialize(image, init_info)  #
         if out is None:
@@ -131,7 +178,7 @@ class Tracker:
         _store_outputs(out, init_default)
 
         for frame_num, frame_path in enumerate(seq.frames[1:], start=1):
-            image = self._read_image(frame_path)
+            image = prefetcher.read(frame_path, bgr)
 
             start_time = time.time()
 
@@ -171,7 +218,7 @@ class Tracker:
             tracker = self.create_tracker(params)
 
         elif multiobj_mode == 'parallel':
-            tracker = MultiObjectWrapper(self.tracker_class, params, self.visdom, fast_load=True)
+            tracker = MultiObjectWrapper(self.create_tracker(params))
         else:
             raise ValueError('Unknown multi object mode {}'.format(multiobj_mode))
 
@@ -212,6 +259,9 @@ class Tracker:
                 output_boxes.append(init_state)
                 break
 
+        track_time = 0.0
+        num_tracked = 0
+
         while True:
             ret, frame = cap.read()
 
@@ -221,12 +271,19 @@ class Tracker:
             frame_disp = frame.copy()
 
             # Draw box
+            start_time = time.time()
             out = tracker.track(frame)
-            state = [int(s) for s in out['target_bbox']]
-            output_boxes.append(state)
-
-            cv.rectangle(frame_disp, (state[0], state[1]), (state[2] + state[0], state[3] + state[1]),
-                         (0, 255, 0), 5)
+            track_time += time.time() - start_time
+            num_tracked += 1
+            if isinstance(out['target_bbox'], (dict, OrderedDict)):
+                states = [[int(s) for s in box] for box in out['target_bbox'].values()]
+            else:
+                states = [[int(s) for s in out['target_bbox']]]
+            output_boxes.append([s for state in states for s in state])
+
+            for state in states:
+                cv.rectangle(frame_disp, (state[0], state[1]), (state[2] + state[0], state[3] + state[1]),
+                             (0, 255, 0), 5)
 
             font_color = (0, 0, 0)
             cv.putText(frame_disp, 'Tracking!', (20, 30), cv.FONT_HERSHEY_COMPLEX_SMALL, 1,
@@ -258,6 +315,9 @@ class Tracker:
         cap.release()
         cv.destroyAllWindows()
 
+        if num_tracked > 0:
+            print('FPS: {}'.format(num_tracked / track_time))
+
         if save_results:
             if not os.path.exists(self.results_dir):
                 os.makedirs(self.results_dir)
@@ -273,13 +333,22 @@ class Tracker:
         """Get parameters."""
         param_module = importlib.import_module('lib.test.parameter.{}'.format(self.name))
         params = param_module.parameters(self.parameter_name)
+        for name, val in self.param_overrides.items():
+            setattr(params, name, val)
         return params
 
-    def _read_image(self, image_file: str):
+    @staticmethod
+    def _read_image(image_file: str, bgr=False):
+        """Read a frame in RGB order, or in the BGR order of OpenCV with bgr (see BaseTracker.expects_bgr_input)."""
         if isinstance(image_file, str):
             im = cv.imread(image_file)       #默认读取彩色图像
+            if bgr:
+                return im
             return cv.cvtColor(im, cv.COLOR_BGR2RGB)    #颜色空间转换 按照RGB的顺序排列
         elif isinstance(image_file, list) and len(image_file) == 2:
+            if bgr:
+                # decoded in the BGR order of OpenCV as it is, decode_img converts the frame to RGB
+                return _decode_img_bgr(image_file[0], image_file[1])
             return decode_img(image_file[0], image_file[1])
         else:
             raise ValueError("type of image_file should be str or list")
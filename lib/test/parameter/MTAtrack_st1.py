@@ -23,6 +23,47 @@ def parameters(yaml_name: str):
     # Network checkpoint path
     params.checkpoint = os.path.join(save_dir, "checkpoints/%s/MTAtrackS_ep%04d.pth.tar" %
                                      (yaml_name, cfg.TEST.EPOCH))
+    # Memory-mappable inference weights, written by tracking/export_weights.py
+    params.weights_path = os.path.join(save_dir, "checkpoints/%s/MTAtrackS_ep%04d.weights" % (yaml_name, cfg.TEST.EPOCH))
+    params.flat_weights = cfg.TEST.FLAT_WEIGHTS
+    # Statically quantized backbone, written by tracking/calibrate_backbone.py
+    params.backbone_int8_path = os.path.join(save_dir, "checkpoints/%s/MTAtrackS_ep%04d_backbone_int8.pt" %
+                                             (yaml_name, cfg.TEST.EPOCH))
+    # Prefix of the frozen TorchScript graphs, written by tracking/export_model.py
+    params.jit_prefix = os.path.join(save_dir, "checkpoints/%s/MTAtrackS_ep%04d_jit" % (yaml_name, cfg.TEST.EPOCH))
+    # Prefix of the ONNX graphs, written by tracking/export_model.py --format onnx
+    params.onnx_prefix = os.path.join(save_dir, "checkpoints/%s/MTAtrackS_ep%04d_onnx" % (yaml_name, cfg.TEST.EPOCH))
+
+    # inference backend and device
+    params.backend = cfg.TEST.BACKEND
+    params.device = cfg.TEST.DEVICE
+    params.num_threads = cfg.TEST.NUM_THREADS
+
+    # frame decoding ahead of the tracker, see lib/test/evaluation/prefetch.py
+    params.prefetch_depth = cfg.TEST.PREFETCH_DEPTH
+    params.prefetch_workers = cfg.TEST.PREFETCH_WORKERS
+
+    # inference optimizations
+    params.pos_cache_size = cfg.TEST.POS_CACHE_SIZE
+    params.interleave_enc_dec = cfg.TEST.INTERLEAVE_ENC_DEC
+    params.fused_attention = cfg.TEST.FUSED_ATTENTION
+    params.fold_query_path = cfg.TEST.FOLD_QUERY_PATH
+    params.fuse_corner_head = cfg.TEST.FUSE_CORNER_HEAD
+    params.fold_batchnorm = cfg.TEST.FOLD_BATCHNORM
+    params.raw_bgr_input = cfg.TEST.RAW_BGR_INPUT
+    params.quantize_dynamic = cfg.TEST.QUANTIZE_DYNAMIC
+    params.backbone_int8 = cfg.TEST.BACKBONE_INT8
+    params.jit = cfg.TEST.JIT
+    params.channels_last = cfg.TEST.CHANNELS_LAST
+    params.autocast_bf16 = cfg.TEST.AUTOCAST_BF16
+    params.roi_crop = cfg.TEST.ROI_CROP
+
+    # attention map capture for debugging, off when no layer is selected
+    params.attn_capture_layers = cfg.TEST.ATTN_CAPTURE.LAYERS
+    params.attn_capture_every = cfg.TEST.ATTN_CAPTURE.EVERY
+    params.attn_capture_frames = cfg.TEST.ATTN_CAPTURE.FRAMES
+    params.attn_capture_max_files = cfg.TEST.ATTN_CAPTURE.MAX_FILES
+    params.attn_capture_dir = os.path.join(save_dir, "attention_maps/%s" % yaml_name)
 
     # whether to save boxes from all queries
     params.save_all_boxes = False
@@ -0,0 +1,123 @@
+import numpy as np
+from lib.train.data.processing_utils import sample_target
+from lib.test.tracker.MTAtrack_utils import TokenBuffer, crop_input
+
+
+class BatchedMTAtrack(object):
+    """
+    Runs the network of an MTAtrack tracker (MTAtrack_S or MTAtrack_ST) on up to batch_size sequences in lock step.
+    The search regions of all the tracked sequences go through one backbone call and one transformer call. Every
+    sequence has its own slot: a column of a batched TokenBuffer holding its templates, and its own state, so a slot
+    can be initialized with a new sequence while the other slots keep tracking.
+    Only the eager torch backend is supported, the exported graphs have a static batch size of 1.
+    """
+    def __init__(self, tracker, batch_size: int):
+        params = tracker.params
+        if params.get('backend', 'torch') != 'torch' or params.get('jit', False):
+            raise ValueError("Batched tracking needs the eager torch backend.")
+        if params.save_all_boxes:
+            raise ValueError("Batched tracking does not save the boxes of all queries.")
+        self.params = params
+        self.engine = tracker.engine
+        self.preprocessor = tracker.preprocessor
+        self.crop_engine = tracker.crop_engine
+        self.batch_size = batch_size
+        # template update of MTAtrack_ST, the 1st template slot keeps the template from the 1st frame
+        self.update_intervals = getattr(tracker, 'update_intervals', [])
+        self.token_buffer = TokenBuffer(tracker.token_buffer.num_templates, self.engine.feat_len_s)
+        self.states = np.zeros((batch_size, 4))
+        self.frame_ids = np.zeros(batch_size, dtype=int)
+
+    def initialize(self, slot: int, image, init_bbox: list):
+        """Start tracking a new sequence in a slot."""
+        template, _ = crop_input(image, init_bbox, self.params.template_factor, self.params.template_size,
+                                 self.preprocessor, self.crop_engine)
+        z_dict = self.engine.forward_backbone(template)
+        if self.token_buffer.seq_dict is None:
+            self.token_buffer.allocate(z_dict, self.batch_size)
+        for i in range(self.token_buffer.num_templates):
+            self.token_buffer.set_template(i, z_dict, cols=[slot])
+        self.states[slot] = init_bbox
+        self.frame_ids[slot] = 0
+
+    def resize(self, batch_size: int):
+        """Change the number of slots, the slots below both sizes keep their sequences."""
+        if self.token_buffer.seq_dict is not None:
+            self.token_buffer.resize(batch_size)
+        bs = min(batch_size, self.batch_size)
+        states, frame_ids = self.states, self.frame_ids
+        self.states = np.zeros((batch_size, 4))
+        self.frame_ids = np.zeros(batch_size, dtype=int)
+        self.states[:bs], self.frame_ids[:bs] = states[:bs], frame_ids[:bs]
+        self.batch_size = batch_size
+
+    def track(self, images: dict):
+        """Track the next frame of the sequences of some slots, images: {slot: image}.
+        Return {slot: {"target_bbox": [x1, y1, w, h], ["conf_score": float]}}."""
+        slots = sorted(images.keys())
+        search_size = self.params.search_size
+        if self.crop_engine is not None:
+            # all the search regions are cropped into one batch buffer
+            x_patch_arr, resize_factors, rects = self.crop_engine.crop_batch(
+                [images[b] for b in slots], [self.states[b].tolist() for b in slots], self.params.search_factor,
+                search_size)
+            search = self.preprocessor.process_rects(x_patch_arr, rects)
+        else:
+            crops = [sample_target(images[b], self.states[b].tolist(), self.params.search_factor,
+                                   output_sz=search_size) for b in slots]
+            resize_factors = [resize_factor for _, resize_factor, _ in crops]
+            search = self.preprocessor.process_batch([x_patch_arr for x_patch_arr, _, _ in crops],
+                                                     [x_amask_arr for _, _, x_amask_arr in crops])
+        resize_factors = np.array(resize_factors)
+        x_dict = self.engine.forward_backbone(search)
+        self.token_buffer.set_search(x_dict, cols=slots)
+        out_dict = self.engine.forward_transformer(self.token_buffer.get_seq_dict(slots), run_cls_head=True)
+        # Baseline: Take the mean of all pred boxes as the final result
+        pred_boxes = out_dict['pred_boxes'].view(len(slots), -1, 4).mean(dim=1).cpu().numpy()
+        pred_boxes = pred_boxes * search_size / resize_factors[:, None]
+        sizes = np.array([images[b].shape[:2] for b in slots])
+        self.states[slots] = clip_box_batch(map_box_back_batch(pred_boxes, self.states[slots], resize_factors,
+                                                               search_size), sizes[:, 0], sizes[:, 1], margin=10)
+        self.frame_ids[slots] += 1
+
+        outputs = {b: {"target_bbox": self.states[b].tolist()} for b in slots}
+        if 'pred_logits' in out_dict:
+            conf_scores = out_dict['pred_logits'].view(len(slots)).sigmoid().cpu().numpy()
+            for b, conf_score in zip(slots, conf_scores):
+                outputs[b]["conf_score"] = float(conf_score)
+                self._update_templates(b, images[b], conf_score)
+        return outputs
+
+    def _update_templates(self, slot: int, image, conf_score: float):
+        for idx, update_i in enumerate(self.update_intervals):
+            if self.frame_ids[slot] % update_i == 0 and conf_score > 0.5:
+                template, _ = crop_input(image, self.states[slot].tolist(), self.params.template_factor,
+                                         self.params.template_size, self.preprocessor, self.crop_engine)
+                z_dict = self.engine.forward_backbone(template)
+                self.token_buffer.set_template(idx + 1, z_dict, cols=[slot])
+
+
+def map_box_back_batch(pred_boxes: np.ndarray, states: np.ndarray, resize_factors: np.ndarray, search_size: int):
+    """map_box_back of the trackers for K sequences.
+    pred_boxes: (K, 4) boxes (cx, cy, w, h) in the search regions, in image pixels
+    states: (K, 4) previous boxes (x1, y1, w, h)
+    resize_factors: (K,)"""
+    cx_prev, cy_prev = states[:, 0] + 0.5 * states[:, 2], states[:, 1] + 0.5 * states[:, 3]
+    cx, cy, w, h = pred_boxes.T
+    half_side = 0.5 * search_size / resize_factors
+    cx_real = cx + (cx_prev - half_side)
+    cy_real = cy + (cy_prev - half_side)
+    return np.stack([cx_real - 0.5 * w, cy_real - 0.5 * h, w, h], axis=1)
+
+
+def clip_box_batch(boxes: np.ndarray, H: np.ndarray, W: np.ndarray, margin=0):
+    """clip_box for K boxes (x1, y1, w, h) in images of heights H and widths W (K,)."""
+    x1, y1, w, h = boxes.T
+    x2, y2 = x1 + w, y1 + h
+    x1 = np.minimum(np.maximum(0, x1), W - margin)
+    x2 = np.minimum(np.maximum(margin, x2), W)
+    y1 = np.minimum(np.maximum(0, y1), H - margin)
+    y2 = np.minimum(np.maximum(margin, y2), H)
+    w = np.maximum(margin, x2 - x1)
+    h = np.maximum(margin, y2 - y1)
+    return np.stack([x1, y1, w, h], axis=1)
@@ -0,0 +1,126 @@
+from contextlib import nullcontext
+
+import torch
+from lib.utils.misc import NestedTensor
+from lib.models.MTAtrack.MTAtrack_s import ASSIGN_LOAD
+from lib.models.MTAtrack.export import get_graph_paths
+from lib.models.MTAtrack.weights import load_flat_weights
+from lib.test.tracker.MTAtrack_utils import prepare_network, get_network_stats, get_copying_options
+
+
+class InferenceEngine(object):
+    """What the trackers need from the network: the backbone and the transformer with the heads.
+
+    Inputs and outputs are torch tensors on the inference device, the feature dicts have the layout of
+    MTAtrackS.adjust (feat/pos: (HW, B, C), mask: (B, HW))."""
+    feat_len_s = None
+
+    def forward_backbone(self, input: NestedTensor) -> dict:
+        raise NotImplementedError
+
+    def forward_transformer(self, seq_dict: dict, run_cls_head=False) -> dict:
+        """Run the transformer and the box head, and the classification head if asked and the network has one.
+        Return the output dict."""
+        raise NotImplementedError
+
+    def get_stats(self) -> dict:
+        return {}
+
+
+class TorchEngine(InferenceEngine):
+    """Runs the PyTorch network, eager or the TorchScript graphs (see prepare_network).
+    With autocast_bf16 the network runs under cpu bf16 autocast: the features stay in bf16 between the backbone
+    and the transformer, the outputs of the heads are returned in float32."""
+    def __init__(self, network, autocast_bf16=False):
+        self.network = network
+        self.feat_len_s = network.feat_len_s
+        self.autocast_bf16 = autocast_bf16
+
+    @torch.no_grad()
+    def forward_backbone(self, input: NestedTensor):
+        with self._autocast():
+            return self.network.forward_backbone(input)
+
+    @torch.no_grad()
+    def forward_transformer(self, seq_dict: dict, run_cls_head=False):
+        with self._autocast():
+            out_dict, _, _ = self.network.forward_transformer(seq_dict=seq_dict, run_box_head=True,
+                                                              run_cls_head=run_cls_head)
+        return {k: v.float() for k, v in out_dict.items()}
+
+    def get_stats(self):
+        return get_network_stats(self.network)
+
+    def _autocast(self):
+        # torch.autocast is only entered when enabled, it does not exist before torch 1.10
+        return torch.autocast('cpu', dtype=torch.bfloat16) if self.autocast_bf16 else nullcontext()
+
+
+class OnnxEngine(InferenceEngine):
+    """Runs the ONNX graphs exported by tracking/export_model.py with onnxruntime on cpu.
+    The tensors are handed to onnxruntime as numpy arrays sharing their memory, no copy is made."""
+    def __init__(self, sessions: dict, template_size: int, search_size: int):
+        self.backbones = {template_size: sessions["template"], search_size: sessions["search"]}
+        self.transformer = sessions["transformer"]
+        # the graphs have static shapes, the search feature is (HW, B, C)
+        self.feat_len_s = sessions["search"].get_outputs()[0].shape[0]
+
+    @classmethod
+    def load(cls, prefix: str, template_size: int, search_size: int, num_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        sessions = {name: ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+                    for name, path in get_graph_paths(prefix, template_size, search_size, ext='onnx').items()}
+        return cls(sessions, template_size, search_size)
+
+    def forward_backbone(self, input: NestedTensor):
+        session = self.backbones[input.tensors.shape[-1]]
+        feat, mask, pos = session.run(None, {"img": input.tensors.numpy(), "img_mask": input.mask.numpy()})
+        return {"feat": torch.from_numpy(feat), "mask": torch.from_numpy(mask), "pos": torch.from_numpy(pos)}
+
+    def forward_transformer(self, seq_dict: dict, run_cls_head=False):
+        outputs = self.transformer.run(None, {name: seq_dict[name].numpy() for name in ("feat", "mask", "pos")})
+        out_dict = {'pred_boxes': torch.from_numpy(outputs[0])}
+        if run_cls_head and len(outputs) > 1:
+            out_dict['pred_logits'] = torch.from_numpy(outputs[1])
+        return out_dict
+
+
+def build_engine(params, build_network, device):
+    """Build the inference engine selected by params.backend, "torch" (default) or "onnx"."""
+    backend = params.get('backend', 'torch')
+    if backend == 'torch':
+        network = build_network(params.cfg, inference=True)
+        if params.get('flat_weights', False):
+            if not ASSIGN_LOAD:
+                raise ValueError("Flat weights need load_state_dict(..., assign=True), torch >= 2.1.")
+            if get_copying_options(params):
+                raise ValueError("Flat weights are not shared with %s, these options copy the parameters."
+                                 % ", ".join(get_copying_options(params)))
+            # written by tracking/export_weights.py, the parameters stay views of the shared memory map
+            network.load_state_dict(load_flat_weights(params.weights_path), strict=True, assign=True)
+        else:
+            network.load_state_dict(torch.load(params.checkpoint, map_location='cpu')['net'], strict=True,
+                                    **({'assign': True} if ASSIGN_LOAD else {}))
+        if ASSIGN_LOAD:
+            # the network is built on the meta device, every tensor must come from the weights
+            not_loaded = [name for name, t in list(network.named_parameters()) + list(network.named_buffers())
+                          if t.is_meta]
+            if not_loaded:
+                raise ValueError("Tensors not loaded from the weights: %s" % ", ".join(not_loaded))
+        network = prepare_network(network, params).to(device)
+        network.eval()
+        autocast_bf16 = params.get('autocast_bf16', False)
+        if autocast_bf16 and device.type != 'cpu':
+            raise ValueError("bf16 autocast is only supported on cpu.")
+        return TorchEngine(network, autocast_bf16)
+    elif backend == 'onnx':
+        if device.type != 'cpu':
+            raise ValueError("The onnx backend only runs on cpu.")
+        return OnnxEngine.load(params.onnx_prefix, params.template_size, params.search_size,
+                               params.get('num_threads', 0))
+    else:
+        raise ValueError("Unknown inference backend %s" % backend)
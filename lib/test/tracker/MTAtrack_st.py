@@ -1,25 +1,24 @@
 from lib.test.tracker.basetracker import BaseTracker
 import torch
-from lib.train.data.processing_utils import sample_target
-from copy import deepcopy
 # for debug
 import cv2
 import os
-from lib.utils.merge import merge_template_search
 from lib.models.MTAtrack import build_MTAtrackst
-from lib.test.tracker.MTAtrack_utils import Preprocessor
+from lib.test.tracker.MTAtrack_utils import Preprocessor, TokenBuffer, CropEngine, crop_input, get_inference_device
+from lib.test.tracker.MTAtrack_engine import build_engine
 from lib.utils.box_ops import clip_box
 
 
 class MTAtrack_ST(BaseTracker):
     def __init__(self, params, dataset_name):
         super(MTAtrack_ST, self).__init__(params)
-        network = build_MTAtrackst(params.cfg)
-        network.load_state_dict(torch.load(self.params.checkpoint, map_location='cpu')['net'], strict=True)  #加载模型
         self.cfg = params.cfg
-        self.network = network.cuda()
-        self.network.eval()
-        self.preprocessor = Preprocessor()
+        self.device = get_inference_device(params)
+        self.engine = build_engine(params, build_MTAtrackst, self.device)
+        self.bgr_input = params.get('raw_bgr_input', False)
+        self.preprocessor = Preprocessor(device=self.device, channels_last=params.get('channels_last', False),
+                                         raw_input=self.bgr_input)
+        self.crop_engine = CropEngine() if params.get('roi_crop', False) else None
         self.state = None
         # for debug
         self.debug = False
@@ -32,7 +31,6 @@ class MTAtrack_ST(BaseTracker):
         self.save_all_boxes = params.save_all_boxes  #false
         # template update
         self.z_dict1 = {}
-        self.z_dict_list = []
         # Set the update interval
         DATASET_NAME = dataset_name.upper()
         if hasattr(self.cfg.TEST.UPDATE_INTERVALS, DATASET_NAME):
@@ -41,20 +39,18 @@ class MTAtrack_ST(BaseTracker):
             self.update_intervals = self.cfg.DATA.MAX_SAMPLE_INTERVAL
         print("Update interval is: ", self.update_intervals)
         self.num_extra_template = len(self.update_intervals)
+        # the 1st template, the extra templates and the search region share one pre-concatenated buffer
+        self.token_buffer = TokenBuffer(1 + self.num_extra_template, self.engine.feat_len_s)
 
     def initialize(self, image, info: dict):
-        # initialize z_dict_list
-        self.z_dict_list = []
         # get the 1st template
-        z_patch_arr1, _, z_amask_arr1 = sample_target(image, info['init_bbox'], self.params.template_factor,
-                                                      output_sz=self.params.template_size)
-        template1 = self.preprocessor.process(z_patch_arr1, z_amask_arr1)
-        with torch.no_grad():
-            self.z_dict1 = self.network.forward_backbone(template1)
-        # get the complete z_dict_list
-        self.z_dict_list.append(self.z_dict1)
-        for i in range(self.num_extra_template):
-            self.z_dict_list.append(deepcopy(self.z_dict1))
+        template1, _ = crop_input(image, info['init_bbox'], self.params.template_factor, self.params.template_size,
+                                  self.preprocessor, self.crop_engine)
+        self.z_dict1 = self.engine.forward_backbone(template1)
+        # fill all the template slots with the 1st template
+        self.token_buffer.allocate(self.z_dict1)
+        for i in range(1 + self.num_extra_template):
+            self.token_buffer.set_template(i, self.z_dict1)
 
         # save states
         self.state = info['init_bbox']
@@ -68,17 +64,14 @@ class MTAtrack_ST(BaseTracker):
         H, W, _ = image.shape
         self.frame_id += 1
         # get the t-th search region
-        x_patch_arr, resize_factor, x_amask_arr = sample_target(image, self.state, self.params.search_factor,
-                                                                output_sz=self.params.search_size)  # (x1, y1, w, h)
+        search, resize_factor = crop_input(image, self.state, self.params.search_factor, self.params.search_size,
+                                           self.preprocessor, self.crop_engine)  # (x1, y1, w, h)
 
-        search = self.preprocessor.process(x_patch_arr, x_amask_arr)
-        with torch.no_grad():
-            x_dict = self.network.forward_backbone(search)
-            # merge the template and the search
-            feat_dict_list = self.z_dict_list + [x_dict]
-            seq_dict = merge_template_search(feat_dict_list)
-            # run the transformer
-            out_dict, _, _ = self.network.forward_transformer(seq_dict=seq_dict, run_box_head=True, run_cls_head=True)
+        x_dict = self.engine.forward_backbone(search)
+        # write the search region behind the templates
+        self.token_buffer.set_search(x_dict)
+        # run the transformer
+        out_dict = self.engine.forward_transformer(self.token_buffer.seq_dict, run_cls_head=True)
         # get the final result
         pred_boxes = out_dict['pred_boxes'].view(-1, 4)
         # Baseline: Take the mean of all pred boxes as the final result
@@ -90,17 +83,15 @@ class MTAtrack_ST(BaseTracker):
         # update template
         for idx, update_i in enumerate(self.update_intervals):
             if self.frame_id % update_i == 0 and conf_score > 0.5:
-                z_patch_arr, _, z_amask_arr = sample_target(image, self.state, self.params.template_factor,
-                                                            output_sz=self.params.template_size)
-                template_t = self.preprocessor.process(z_patch_arr, z_amask_arr)
-                with torch.no_grad():
-                    z_dict_t = self.network.forward_backbone(template_t)
-                self.z_dict_list[idx+1] = z_dict_t  # the 1st element of z_dict_list is template from the 1st frame
+                template_t, _ = crop_input(image, self.state, self.params.template_factor,
+                                           self.params.template_size, self.preprocessor, self.crop_engine)
+                z_dict_t = self.engine.forward_backbone(template_t)
+                self.token_buffer.set_template(idx+1, z_dict_t)  # the 1st slot is the template from the 1st frame
 
         # for debug
         if self.debug:
             x1, y1, w, h = self.state
-            image_BGR = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            image_BGR = image.copy() if self.bgr_input else cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
             cv2.rectangle(image_BGR, (int(x1),int(y1)), (int(x1+w),int(y1+h)), color=(0,0,255), thickness=2)
             save_path = os.path.join(self.save_dir, "%04d.jpg" % self.frame_id)
             cv2.imwrite(save_path, image_BGR)
@@ -115,6 +106,18 @@ class MTAtrack_ST(BaseTracker):
             return {"target_bbox": self.state,
                     "conf_score": conf_score}
 
+    def expects_bgr_input(self):
+        return self.bgr_input
+
+    def reset(self):
+        # the network, the preprocessor and the buffers are kept, initialize refills the template slots
+        self.state = None
+        self.frame_id = 0
+        self.z_dict1 = {}
+
+    def get_stats(self):
+        return self.engine.get_stats()
+
     def map_box_back(self, pred_box: list, resize_factor: float):
         cx_prev, cy_prev = self.state[0] + 0.5 * self.state[2], self.state[1] + 0.5 * self.state[3]
         cx, cy, w, h = pred_box
@@ -1,22 +1,380 @@
+import math
+import cv2 as cv
 import torch
 import numpy as np
+from lib.train.data.processing_utils import sample_target
 from lib.utils.misc import NestedTensor
+from lib.models.MTAtrack.backbone import NestedRectTensor
+from lib.models.MTAtrack.head import Corner_Predictor, Corner_Predictor_Fused
+from lib.models.MTAtrack.fusion import fold_batchnorm, fold_query_path, fold_input_normalization
+from lib.models.MTAtrack.attention import replace_attention, AttentionCapture, AttentionStore
+from lib.models.MTAtrack.quantization import quantize_dynamic_int8, load_quantized_backbone
+from lib.models.MTAtrack.export import GraphNetwork
+from lib.models.MTAtrack.position_encoding import PositionEmbeddingCache
+
+# tracker params that turn every inference option off, the reference when verifying an optimized network
+REFERENCE_PARAMS = {'backend': 'torch',
+                    'flat_weights': False,
+                    'pos_cache_size': 0,
+                    'interleave_enc_dec': False,
+                    'fused_attention': False,
+                    'fold_query_path': False,
+                    'fuse_corner_head': False,
+                    'fold_batchnorm': False,
+                    'raw_bgr_input': False,
+                    'quantize_dynamic': False,
+                    'backbone_int8': False,
+                    'jit': False,
+                    'channels_last': False,
+                    'autocast_bf16': False,
+                    'roi_crop': False}
+# inference options rebuilding parameters of the loaded network into new tensors, see get_copying_options
+COPYING_OPTIONS = ('backbone_int8', 'fold_batchnorm', 'raw_bgr_input', 'fused_attention', 'fold_query_path',
+                   'fuse_corner_head', 'quantize_dynamic', 'channels_last')
 
 
 class Preprocessor(object):
-    def __init__(self):
-        self.mean = torch.tensor([0.485, 0.456, 0.406]).view((1, 3, 1, 1)).cuda()  #view改变数组的形状
-        self.std = torch.tensor([0.229, 0.224, 0.225]).view((1, 3, 1, 1)).cuda()
+    """With raw_input the uint8 patches are passed on as they are, for a network whose first conv does the
+    normalization (see fusion.fold_input_normalization).
+
+    The patches are turned into tensors in a workspace owned by the preprocessor, one per input shape (batch size,
+    height, width): the numpy patch is read with torch.from_numpy, converted and normalized in place in the
+    workspace, and on cuda uploaded through pinned host memory without blocking. The returned tensors are views
+    of the workspace, valid until the next patch of the same shape."""
+    def __init__(self, device='cuda', channels_last=False, raw_input=False):
+        self.device = torch.device(device)
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.raw_input = raw_input
+        self.mean = torch.tensor([0.485, 0.456, 0.406]).view((1, 3, 1, 1)).to(self.device)  #view改变数组的形状
+        self.std = torch.tensor([0.229, 0.224, 0.225]).view((1, 3, 1, 1)).to(self.device)
+        self.workspaces = {}
 
     def process(self, img_arr: np.ndarray, amask_arr: np.ndarray):
         # Deal with the image patch
-        img_tensor = torch.tensor(img_arr).cuda().float().permute((2,0,1)).unsqueeze(dim=0)   #permute：对数组的元素进行换位   unsqueeze(dim=0) 增加一维
-        img_tensor_norm = ((img_tensor / 255.0) - self.mean) / self.std  # (1,3,H,W)
-        # Deal with the attention mask
-        amask_tensor = torch.from_numpy(amask_arr).to(torch.bool).cuda().unsqueeze(dim=0)  # (1,H,W)   #torch.from_numpy()方法把数组转换成张量，且二者共享内存，对张量进行修改比如重新赋值，那么原始数组也会相应发生改变。
+        img_tensor_norm = self._process_image(img_arr)
+        # Deal with the attention mask, kept on the host as the unpadded rectangle when it is one
+        rect = get_unpadded_rect(amask_arr)
+        if rect is not None:
+            return NestedRectTensor(img_tensor_norm, [rect])
+        amask_tensor = torch.from_numpy(amask_arr).to(torch.bool).unsqueeze(dim=0)  # (1,H,W)   #torch.from_numpy()方法把数组转换成张量，且二者共享内存，对张量进行修改比如重新赋值，那么原始数组也会相应发生改变。
+        amask_tensor = self._upload(self._get_workspace(*amask_tensor.shape), 'mask', amask_tensor)
         return NestedTensor(img_tensor_norm, amask_tensor)
     #当mask的数据类型是torch.uint8或者torch.bool时，此时的tensor用作mask, tensor中的1对应的行/列保留，0对应的行/列舍去。且被mask的维度必须与原始tensor的维度一致，即mask.size(0)==t.shape(0）。
 
+    def process_batch(self, img_arrs: list, amask_arrs: list):
+        """process for several patches of the same size at once, they share one workspace of batch size B."""
+        img_tensor_norm = self._process_image(np.stack(img_arrs))
+        rects = [get_unpadded_rect(amask_arr) for amask_arr in amask_arrs]
+        if all(rect is not None for rect in rects):
+            return NestedRectTensor(img_tensor_norm, rects)
+        amask_tensor = torch.from_numpy(np.stack(amask_arrs)).to(torch.bool)  # (B,H,W)
+        amask_tensor = self._upload(self._get_workspace(*amask_tensor.shape), 'mask', amask_tensor)
+        return NestedTensor(img_tensor_norm, amask_tensor)
+
+    def process_rects(self, img_arr: np.ndarray, rects: list):
+        """Patches (H,W,3) or (B,H,W,3) whose padding is given by the unpadded rectangles of the CropEngine."""
+        return NestedRectTensor(self._process_image(img_arr), rects)
+
+    def _process_image(self, img_arr: np.ndarray):
+        """(H,W,3) or (B,H,W,3) uint8 --> (B,3,H,W)"""
+        if img_arr.ndim == 3:
+            img_arr = img_arr[None]
+        b, h, w, _ = img_arr.shape
+        workspace = self._get_workspace(b, h, w)
+        img_tensor = self._upload(workspace, 'patch', torch.from_numpy(img_arr))  # no copy on cpu
+        img_tensor = img_tensor.permute((0, 3, 1, 2))  # (B,3,H,W) with channels-last strides
+        if self.raw_input and img_tensor.is_contiguous(memory_format=self.memory_format):
+            return img_tensor
+        # the conversion to float (or the layout change of the raw patch) in one copy, then in place
+        img_tensor_norm = workspace["img"]
+        img_tensor_norm.copy_(img_tensor)
+        if not self.raw_input:
+            img_tensor_norm.div_(255.0).sub_(self.mean).div_(self.std)
+        return img_tensor_norm
+
+    def _get_workspace(self, b: int, h: int, w: int):
+        key = (b, h, w)
+        if key not in self.workspaces:
+            dtype = torch.uint8 if self.raw_input else torch.float32
+            self.workspaces[key] = {"img": torch.empty((b, 3, h, w), dtype=dtype, device=self.device,
+                                                       memory_format=self.memory_format)}
+        return self.workspaces[key]
+
+    def _upload(self, workspace: dict, name: str, host_tensor: torch.Tensor):
+        """Copy a host tensor to the device buffer `name` of a workspace through a pinned staging buffer, without
+        blocking. The staging buffer is only rewritten once the previous upload from it is done."""
+        if self.device.type == 'cpu':
+            return host_tensor
+        if self.device.type != 'cuda':
+            return host_tensor.to(self.device)
+        if name not in workspace:
+            workspace[name] = {"device": torch.empty(host_tensor.shape, dtype=host_tensor.dtype, device=self.device),
+                               "host": torch.empty(host_tensor.shape, dtype=host_tensor.dtype).pin_memory(),
+                               "event": torch.cuda.Event()}
+        buffers = workspace[name]
+        buffers["event"].synchronize()
+        buffers["host"].copy_(host_tensor)
+        buffers["device"].copy_(buffers["host"], non_blocking=True)
+        buffers["event"].record()
+        return buffers["device"]
+
+
+def get_unpadded_rect(amask_arr: np.ndarray):
+    """The unpadded rectangle (x0, y0, x1, y1) of an attention mask (True on padded pixels), None if the
+    unpadded pixels do not form a non-empty rectangle."""
+    not_mask = amask_arr == 0
+    rows = np.flatnonzero(not_mask.any(axis=1))
+    cols = np.flatnonzero(not_mask.any(axis=0))
+    if len(rows) == 0:
+        return None
+    y0, y1, x0, x1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+    # all the unpadded pixels are inside the bounding rectangle, it is filled when the counts match
+    if np.count_nonzero(not_mask) != (y1 - y0) * (x1 - x0):
+        return None
+    return x0, y0, x1, y1
+
+
+class CropEngine(object):
+    """
+    sample_target computed on the region of interest only. The square area around the box is resized straight
+    into a reused output buffer by a single cv.warpAffine, the parts outside the frame are filled with zeros by the
+    border mode and the padding is returned as the unpadded rectangle instead of a dense mask, so the cost only
+    depends on the output size, not on the frame size.
+    The patches match the ones of sample_target up to the rounding of the interpolation (sample_target resizes the
+    padded crop with cv.resize, which replicates the crop border where the warp reads the pixels next to it), the
+    rectangle is the one of its resized mask. As in sample_target, the last row/column of the frame is padding when
+    the crop goes past it.
+    The patches are views of the buffers, they are overwritten by the next crop of the same size and batch size.
+    """
+    def __init__(self):
+        self.buffers = {}
+
+    def get_buffer(self, output_sz: int, batch_size=1):
+        key = (output_sz, batch_size)
+        if key not in self.buffers:
+            self.buffers[key] = np.empty((batch_size, output_sz, output_sz, 3), dtype=np.uint8)
+        return self.buffers[key]
+
+    def crop(self, im: np.ndarray, target_bb, search_area_factor: float, output_sz: int, out: np.ndarray = None):
+        """Return the (output_sz, output_sz, 3) patch, the resize factor and the unpadded rectangle (x0, y0, x1, y1),
+        (0, 0, 0, 0) when the whole patch is padding."""
+        x, y, w, h = target_bb
+        crop_sz = math.ceil(math.sqrt(w * h) * search_area_factor)
+        if crop_sz < 1:
+            raise Exception('Too small bounding box.')
+        x1 = round(x + 0.5 * w - crop_sz * 0.5)
+        y1 = round(y + 0.5 * h - crop_sz * 0.5)
+        x2, y2 = x1 + crop_sz, y1 + crop_sz
+        H, W = im.shape[:2]
+        x1_pad, y1_pad = max(0, -x1), max(0, -y1)
+        x2_pad, y2_pad = max(x2 - W + 1, 0), max(y2 - H + 1, 0)
+        src = im[:H - 1 if y2_pad > 0 else H, :W - 1 if x2_pad > 0 else W]
+        # output pixel (u, v) samples the crop at ((u + 0.5) * scale - 0.5, (v + 0.5) * scale - 0.5), like cv.resize
+        scale = crop_sz / output_sz
+        M = np.array([[scale, 0, x1 + 0.5 * scale - 0.5],
+                      [0, scale, y1 + 0.5 * scale - 0.5]])
+        out = self.get_buffer(output_sz)[0] if out is None else out
+        cv.warpAffine(src, M, (output_sz, output_sz), dst=out, flags=cv.INTER_LINEAR | cv.WARP_INVERSE_MAP,
+                      borderMode=cv.BORDER_CONSTANT, borderValue=0)
+        cols = _resized_span(x1_pad, crop_sz - x2_pad, crop_sz, output_sz)
+        rows = _resized_span(y1_pad, crop_sz - y2_pad, crop_sz, output_sz)
+        rect = (0, 0, 0, 0) if cols is None or rows is None else (cols[0], rows[0], cols[1], rows[1])
+        return out, output_sz / crop_sz, rect
+
+    def crop_batch(self, ims: list, target_bbs: list, search_area_factor: float, output_sz: int):
+        """Crop one patch per image into a (B, output_sz, output_sz, 3) buffer, return it with the resize factors
+        and the unpadded rectangles."""
+        buffer = self.get_buffer(output_sz, len(ims))
+        resize_factors, rects = [], []
+        for i, (im, target_bb) in enumerate(zip(ims, target_bbs)):
+            _, resize_factor, rect = self.crop(im, target_bb, search_area_factor, output_sz, out=buffer[i])
+            resize_factors.append(resize_factor)
+            rects.append(rect)
+        return buffer, resize_factors, rects
+
+
+def _resized_span(start: int, end: int, src_size: int, dst_size: int):
+    """The output pixels [a, b) of cv.resize (INTER_LINEAR) from src_size to dst_size whose source taps all lie in
+    [start, end), None if there is none. The coordinates are computed as cv.resize does, in float32."""
+    scale = 1.0 / (dst_size / src_size)
+    f = ((np.arange(dst_size) + 0.5) * scale - 0.5).astype(np.float32)
+    sx = np.floor(f)
+    fx = f - sx
+    # clamped at the borders with a single tap
+    border = (sx < 0) | (sx >= src_size - 1)
+    fx[border] = 0
+    sx = np.clip(sx, 0, src_size - 1)
+    inside = np.flatnonzero((sx >= start) & (sx < end) & ((fx == 0) | (sx + 1 < end)))
+    if len(inside) == 0:
+        return None
+    return int(inside[0]), int(inside[-1]) + 1
+
+
+def crop_input(image, target_bb, search_area_factor: float, output_sz: int, preprocessor: Preprocessor,
+               crop_engine: CropEngine = None):
+    """sample_target followed by preprocessor.process, with the crop engine when one is given.
+    Return the network input and the resize factor."""
+    if crop_engine is None:
+        patch_arr, resize_factor, amask_arr = sample_target(image, target_bb, search_area_factor, output_sz=output_sz)
+        return preprocessor.process(patch_arr, amask_arr), resize_factor
+    patch_arr, resize_factor, rect = crop_engine.crop(image, target_bb, search_area_factor, output_sz)
+    return preprocessor.process_rects(patch_arr, [rect]), resize_factor
+
+
+def get_copying_options(params):
+    """The options of the tracker params under which prepare_network replaces loaded parameters by private copies,
+    the memory-mapped flat weights are then no longer shared between processes."""
+    return [name for name in COPYING_OPTIONS if params.get(name, False)]
+
+
+def prepare_network(network, params):
+    """Apply the inference options of the tracker params to a network whose weights are loaded."""
+    is_cpu = torch.device(params.get('device', 'cuda')).type == 'cpu'
+    if params.get('backbone_int8', False):
+        if not is_cpu:
+            raise ValueError("The int8 backbone is only supported on cpu.")
+        # calibrated with tracking/calibrate_backbone.py
+        network.backbone[0].body = load_quantized_backbone(params.backbone_int8_path)
+    if params.get('fold_batchnorm', False):
+        fold_batchnorm(network)
+    if params.get('raw_bgr_input', False):
+        if params.get('backbone_int8', False):
+            raise ValueError("The input normalization cannot be folded into the int8 backbone.")
+        # the trackers then feed the uint8 BGR crops, see BaseTracker.expects_bgr_input
+        fold_input_normalization(network)
+    if params.get('fused_attention', False):
+        # before the dynamic quantization, so that the q/k/v/out projections are quantized as well
+        replace_attention(network)
+    if params.get('fold_query_path', False):
+        # also before the dynamic quantization, the folded weights are computed in float
+        fold_query_path(network)
+    if params.get('fuse_corner_head', False) and isinstance(network.box_head, Corner_Predictor):
+        network.box_head = Corner_Predictor_Fused(network.box_head)
+    if params.get('pos_cache_size', 0) > 0:
+        network.backbone[1] = PositionEmbeddingCache(network.backbone[1], params.pos_cache_size)
+    if params.get('interleave_enc_dec', False):
+        network.transformer_mode = "interleave"
+    if params.get('quantize_dynamic', False):
+        if not is_cpu:
+            raise ValueError("Dynamic int8 quantization is only supported on cpu.")
+        quantize_dynamic_int8(network)
+    if params.get('channels_last', False):
+        # only the 4d conv weights change, the linear layers are not affected
+        network = network.to(memory_format=torch.channels_last)
+    if len(params.get('attn_capture_layers', [])) > 0:
+        if params.get('jit', False):
+            raise ValueError("The attention maps can only be captured from the eager network.")
+        store = AttentionStore(params.attn_capture_dir, params.get('attn_capture_max_files', 1000))
+        frames = params.get('attn_capture_frames', [])
+        network.attention_capture = AttentionCapture(store, params.attn_capture_layers,
+                                                     params.get('attn_capture_every', 1),
+                                                     frames if len(frames) > 0 else None).attach(network)
+    if params.get('jit', False):
+        # exported with tracking/export_model.py from a network prepared with the same params
+        network = GraphNetwork.load(params.jit_prefix, params.template_size, params.search_size,
+                                    network.feat_len_s, device=params.get('device', 'cuda'))
+    return network
+
+
+def get_network_stats(network):
+    """Collect the runtime statistics of the caches of a network."""
+    stats = {}
+    for module in network.modules():
+        if isinstance(module, PositionEmbeddingCache):
+            stats.update(module.stats())
+    return stats
+
+
+def get_inference_device(params):
+    """Resolve the inference device from the tracker params and configure torch for it."""
+    device = torch.device(params.get('device', 'cuda'))
+    if device.type == 'cpu':
+        num_threads = params.get('num_threads', 0)
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+    return device
+
+
+class TokenBuffer(object):
+    """Pre-concatenated transformer input holding the template slots followed by the search slot.
+
+    The layout is the one merge_template_search produces (feat/pos: (HW, B, C), mask: (B, HW)), so the
+    buffers can be fed to forward_transformer as they are. Templates are written into their slot only
+    when they change, the search slot is overwritten every frame. seq_dict["padded"] tells on the host
+    whether any slot has padded tokens, the key padding mask can be dropped when none has.
+    A buffer allocated with a batch size holds the tokens of several sequences, one per batch column: the writes
+    can then address some of the columns (cols) and get_seq_dict returns the input of a subset of them."""
+    def __init__(self, num_templates: int, len_x: int):
+        self.num_templates = num_templates
+        self.len_x = len_x
+        self.len_z = None
+        self.seq_dict = None
+        self.padded = np.ones((num_templates + 1, 1), dtype=bool)
+
+    def allocate(self, z_dict: dict, batch_size: int = None):
+        """Allocate the buffers with the size, dtype and device of the template features, and their batch size
+        unless another one is given."""
+        feat = z_dict["feat"]
+        self.len_z, bs, c = feat.shape
+        bs = bs if batch_size is None else batch_size
+        seq_len = self.num_templates * self.len_z + self.len_x
+        self.seq_dict = {"feat": feat.new_empty((seq_len, bs, c)),
+                         "mask": torch.empty((bs, seq_len), dtype=torch.bool, device=feat.device),
+                         "pos": z_dict["pos"].new_empty((seq_len, bs, c)),
+                         "padded": True}
+        self.padded = np.ones((self.num_templates + 1, bs), dtype=bool)
+
+    def resize(self, batch_size: int):
+        """Change the batch size of the allocated buffers, the columns that are kept keep their tokens."""
+        old, old_padded = self.seq_dict, self.padded
+        bs = min(batch_size, old_padded.shape[1])
+        seq_len, _, c = old["feat"].shape
+        self.seq_dict = {"feat": old["feat"].new_empty((seq_len, batch_size, c)),
+                         "mask": old["mask"].new_empty((batch_size, seq_len)),
+                         "pos": old["pos"].new_empty((seq_len, batch_size, c))}
+        self.seq_dict["feat"][:, :bs] = old["feat"][:, :bs]
+        self.seq_dict["mask"][:bs] = old["mask"][:bs]
+        self.seq_dict["pos"][:, :bs] = old["pos"][:, :bs]
+        self.padded = np.ones((self.num_templates + 1, batch_size), dtype=bool)
+        self.padded[:, :bs] = old_padded[:, :bs]
+        self.seq_dict["padded"] = bool(self.padded.any())
+
+    def set_template(self, idx: int, z_dict: dict, cols: list = None):
+        start = idx * self.len_z
+        self._write(z_dict, start, start + self.len_z, idx, cols)
 
+    def set_search(self, x_dict: dict, cols: list = None):
+        start = self.num_templates * self.len_z
+        self._write(x_dict, start, start + self.len_x, self.num_templates, cols)
 
+    def get_seq_dict(self, cols: list = None):
+        """The transformer input of the batch columns cols (all of them by default)."""
+        if cols is None or list(cols) == list(range(self.padded.shape[1])):
+            return self.seq_dict
+        index = torch.as_tensor(cols, device=self.seq_dict["feat"].device)
+        return {"feat": self.seq_dict["feat"].index_select(1, index),
+                "mask": self.seq_dict["mask"].index_select(0, index),
+                "pos": self.seq_dict["pos"].index_select(1, index),
+                "padded": bool(self.padded[:, cols].any())}
 
+    def _write(self, feat_dict: dict, start: int, end: int, slot: int, cols: list = None):
+        """The mask of an unpadded slot is False, it is cleared when a feature dict without mask (unpadded crops)
+        replaces padded tokens, otherwise it is left as it is."""
+        mask = feat_dict["mask"]
+        if cols is None:
+            self.seq_dict["feat"][start:end].copy_(feat_dict["feat"])
+            if mask is not None:
+                self.seq_dict["mask"][:, start:end].copy_(mask)
+            elif self.padded[slot].any():
+                self.seq_dict["mask"][:, start:end] = False
+            self.seq_dict["pos"][start:end].copy_(feat_dict["pos"])
+            self.padded[slot] = feat_dict.get("padded", True)
+        else:
+            self.seq_dict["feat"][start:end, cols] = feat_dict["feat"]
+            if mask is not None:
+                self.seq_dict["mask"][cols, start:end] = mask
+            elif self.padded[slot, cols].any():
+                self.seq_dict["mask"][cols, start:end] = False
+            self.seq_dict["pos"][start:end, cols] = feat_dict["pos"]
+            self.padded[slot, cols] = feat_dict.get("padded", True)
+        self.seq_dict["padded"] = bool(self.padded.any())
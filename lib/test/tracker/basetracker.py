@@ -11,6 +11,10 @@ class BaseTracker:
     def predicts_segmentation_mask(self):
         return False
 
+    def expects_bgr_input(self):
+        """Overload this function in your tracker if it takes the frames in the BGR order of OpenCV instead of RGB."""
+        return False
+
     def initialize(self, image, info: dict) -> dict:
         """Overload this function in your tracker. This should initialize the model."""
         raise NotImplementedError
@@ -19,6 +23,15 @@ class BaseTracker:
         """Overload this function in your tracker. This should track in the frame and update the model."""
         raise NotImplementedError
 
+    def reset(self):
+        """Overload this function in your tracker to clear the state of the previous sequence. Trackers are reused
+        across the sequences of a run, reset is called before initialize."""
+        pass
+
+    def get_stats(self) -> dict:
+        """Overload this function in your tracker to report runtime statistics after a sequence."""
+        return {}
+
     def visdom_draw_tracking(self, image, box, segmentation=None):
         if isinstance(box, OrderedDict):
             box = [v for k, v in box.items()]
@@ -0,0 +1,79 @@
+import os
+import sys
+import argparse
+import numpy as np
+import torch
+
+prj_path = os.path.join(os.path.dirname(__file__), '..')
+if prj_path not in sys.path:
+    sys.path.append(prj_path)
+
+from lib.test.evaluation import get_dataset
+from lib.test.evaluation.tracker import Tracker
+from lib.train.data.processing_utils import sample_target
+from lib.models.MTAtrack.fusion import fold_batchnorm
+from lib.models.MTAtrack.quantization import (prepare_backbone_static, convert_backbone_static,
+                                              save_quantized_backbone, count_fused_conv_relu)
+
+
+def get_calibration_crops(tracker_info, params, dataset, frames_per_sequence):
+    """Yield the template and search crops around the ground truth boxes of evenly spaced frames."""
+    for seq in dataset:
+        frame_ids = np.linspace(0, len(seq.frames) - 1, frames_per_sequence).astype(int)
+        for frame_id in np.unique(frame_ids):
+            bbox = seq.ground_truth_rect[frame_id]
+            if np.isnan(bbox).any() or bbox[2] <= 0 or bbox[3] <= 0:
+                continue
+            image = tracker_info._read_image(seq.frames[frame_id])
+            for factor, size in [(params.template_factor, params.template_size),
+                                 (params.search_factor, params.search_size)]:
+                patch_arr, _, amask_arr = sample_target(image, list(bbox), factor, output_sz=size)
+                yield patch_arr, amask_arr
+
+
+def calibrate(tracker_name, tracker_param, dataset_name, num_sequences, frames_per_sequence, output_path=None):
+    """Calibrate the int8 backbone on crops of a registered dataset and save it next to the checkpoint."""
+    tracker_info = Tracker(tracker_name, tracker_param, dataset_name,
+                           param_overrides={'device': 'cpu', 'backbone_int8': False,
+                                            'raw_bgr_input': False})
+    params = tracker_info.get_parameters()
+    tracker = tracker_info.create_tracker(params)
+    output_path = params.backbone_int8_path if output_path is None else output_path
+
+    dataset = get_dataset(dataset_name)
+    dataset = [dataset[i] for i in range(min(num_sequences, len(dataset)))]
+
+    body = fold_batchnorm(tracker.engine.network.backbone[0].body)
+    example = torch.zeros(1, 3, params.search_size, params.search_size)
+    prepared = prepare_backbone_static(body, example)
+    num_crops = 0
+    with torch.no_grad():
+        for patch_arr, amask_arr in get_calibration_crops(tracker_info, params, dataset, frames_per_sequence):
+            prepared(tracker.preprocessor.process(patch_arr, amask_arr).tensors)
+            num_crops += 1
+    print('Calibrated on {} crops from {} sequences'.format(num_crops, len(dataset)))
+
+    quantized = convert_backbone_static(prepared)
+    print('Fused {} conv+relu pairs'.format(count_fused_conv_relu(quantized)))
+    save_quantized_backbone(quantized, output_path)
+    print('Saved the int8 backbone to {}'.format(output_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate and save the statically quantized int8 backbone.')
+    parser.add_argument('tracker_name', type=str, help='Name of tracking method.')
+    parser.add_argument('tracker_param', type=str, help='Name of config file.')
+    parser.add_argument('--dataset_name', type=str, default='lasot', help='Name of the calibration dataset.')
+    parser.add_argument('--num_sequences', type=int, default=8, help='Number of calibration sequences.')
+    parser.add_argument('--frames_per_sequence', type=int, default=16, help='Number of frames per sequence.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Where to save the int8 backbone, default is params.backbone_int8_path.')
+
+    args = parser.parse_args()
+
+    calibrate(args.tracker_name, args.tracker_param, args.dataset_name, args.num_sequences,
+              args.frames_per_sequence, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import ast
+import argparse
+import numpy as np
+import torch
+
+prj_path = os.path.join(os.path.dirname(__file__), '..')
+if prj_path not in sys.path:
+    sys.path.append(prj_path)
+
+from lib.test.evaluation import get_dataset
+from lib.test.evaluation.tracker import Tracker
+from lib.test.analysis.extract_results import calc_seq_err_robust
+
+
+def parse_overrides(items):
+    """Parse a list of name=value strings into a dict of tracker params."""
+    overrides = {}
+    for item in items or []:
+        name, val = item.split('=', 1)
+        try:
+            overrides[name] = ast.literal_eval(val)
+        except (ValueError, SyntaxError):
+            overrides[name] = val
+    return overrides
+
+
+def evaluate_mode(tracker_info, dataset, plot_bin_gap=0.05):
+    """Run the tracker on the sequences, return the mean per-frame latency (s) and the success AUC (%)."""
+    threshold_set_overlap = torch.arange(0.0, 1.0 + plot_bin_gap, plot_bin_gap, dtype=torch.float64)
+    success_rates = []
+    frame_times = []
+    for seq in dataset:
+        output = tracker_info.run_sequence(seq)
+        # the 1st frame is the initialization
+        frame_times.extend(output['time'][1:])
+        pred_bb = torch.tensor(np.array(output['target_bbox'], dtype=np.float64))
+        anno_bb = torch.tensor(seq.ground_truth_rect)
+        target_visible = torch.tensor(seq.target_visible, dtype=torch.uint8) if seq.target_visible is not None else None
+        err_overlap, _, _, _ = calc_seq_err_robust(pred_bb, anno_bb, seq.dataset, target_visible)
+        success_rates.append((err_overlap.view(-1, 1) > threshold_set_overlap.view(1, -1)).sum(0).float()
+                             / anno_bb.shape[0])
+    auc = torch.stack(success_rates).mean(0).mean().item() * 100.0
+    return float(np.mean(frame_times)), auc
+
+
+def compare_modes(tracker_name, tracker_param, dataset_name, num_sequences, base_overrides, mode_overrides):
+    """Compare the latency and the AUC of the tracker with two sets of tracker params on a dataset subset."""
+    dataset = get_dataset(dataset_name)
+    dataset = [dataset[i] for i in range(min(num_sequences, len(dataset)))]
+
+    base = Tracker(tracker_name, tracker_param, dataset_name, param_overrides=base_overrides)
+    mode = Tracker(tracker_name, tracker_param, dataset_name, param_overrides=dict(base_overrides, **mode_overrides))
+
+    base_latency, base_auc = evaluate_mode(base, dataset)
+    mode_latency, mode_auc = evaluate_mode(mode, dataset)
+
+    print('Compared on {} sequences of {}: {} vs {}'.format(len(dataset), dataset_name, base_overrides or 'defaults',
+                                                            mode_overrides))
+    print('latency: %.2f ms --> %.2f ms per frame (%+.1f%%)' % (base_latency * 1000, mode_latency * 1000,
+                                                                 (mode_latency / base_latency - 1) * 100))
+    print('AUC: %.2f --> %.2f (%+.2f)' % (base_auc, mode_auc, mode_auc - base_auc))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare latency and AUC of two sets of tracker params.')
+    parser.add_argument('tracker_name', type=str, help='Name of tracking method.')
+    parser.add_argument('tracker_param', type=str, help='Name of config file.')
+    parser.add_argument('--dataset_name', type=str, default='lasot', help='Name of dataset.')
+    parser.add_argument('--num_sequences', type=int, default=10, help='Number of sequences evaluated.')
+    parser.add_argument('--base', type=str, nargs='*', default=[],
+                        help='name=value tracker params of the baseline, e.g. device=cpu.')
+    parser.add_argument('--set', type=str, nargs='+', required=True,
+                        help='name=value tracker params of the compared mode, e.g. quantize_dynamic=True.')
+
+    args = parser.parse_args()
+
+    compare_modes(args.tracker_name, args.tracker_param, args.dataset_name, args.num_sequences,
+                  parse_overrides(args.base), parse_overrides(args.set))
+
+
+if __name__ == '__main__':
+    main()
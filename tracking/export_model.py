@@ -0,0 +1,70 @@
+import os
+import sys
+import argparse
+
+prj_path = os.path.join(os.path.dirname(__file__), '..')
+if prj_path not in sys.path:
+    sys.path.append(prj_path)
+
+from lib.test.evaluation.tracker import Tracker
+from lib.models.MTAtrack.export import export_graphs, export_onnx
+from verify_network import get_data, run_network
+
+
+def export(tracker_name, tracker_param, dataset_name='lasot', export_format='torchscript', num_runs=3, atol=1e-4):
+    """Export the network prepared by the parameter file to frozen TorchScript graphs at params.jit_prefix
+    or to ONNX graphs at params.onnx_prefix, then check the tracker running the graphs against the eager one."""
+    if export_format == 'torchscript':
+        eager_overrides = {'backend': 'torch', 'jit': False}
+        graph_overrides = {'backend': 'torch', 'jit': True}
+    else:
+        # onnxruntime runs on cpu and the int8 layers of torch have no ONNX export
+        eager_overrides = {'backend': 'torch', 'jit': False, 'device': 'cpu', 'quantize_dynamic': False,
+                           'backbone_int8': False}
+        graph_overrides = {'backend': 'onnx', 'device': 'cpu'}
+    eager_info = Tracker(tracker_name, tracker_param, dataset_name, param_overrides=eager_overrides)
+    eager = eager_info.create_tracker(eager_info.get_parameters())
+    params = eager.params
+    num_templates = eager.token_buffer.num_templates
+    if export_format == 'torchscript':
+        paths = export_graphs(eager.engine.network, params.template_size, params.search_size, num_templates,
+                              params.jit_prefix, device=eager.device)
+    else:
+        paths = export_onnx(eager.engine.network, params.template_size, params.search_size, num_templates,
+                            params.onnx_prefix)
+    for name, path in paths.items():
+        print('Saved the %s graph to %s' % (name, path))
+
+    graph_info = Tracker(tracker_name, tracker_param, dataset_name, param_overrides=graph_overrides)
+    graph = graph_info.create_tracker(graph_info.get_parameters())
+    max_diff = 0.0
+    for i in range(num_runs):
+        templates = [get_data(params.template_size, 8 * i) for _ in range(num_templates)]
+        search = get_data(params.search_size, 16 * i)
+        out_eager = run_network(eager, templates, search)
+        out_graph = run_network(graph, templates, search)
+        for key, val in out_eager.items():
+            max_diff = max(max_diff, (val - out_graph[key]).abs().max().item())
+    print('max abs diff between the eager network and the graphs is %.3e (tolerance %.1e)' % (max_diff, atol))
+    return max_diff <= atol
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the tracker network to frozen TorchScript or ONNX graphs.')
+    parser.add_argument('tracker_name', type=str, help='Name of tracking method.')
+    parser.add_argument('tracker_param', type=str, help='Name of config file.')
+    parser.add_argument('--dataset_name', type=str, default='lasot',
+                        help='Name of dataset, selects the number of templates the graphs are specialised to.')
+    parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'],
+                        help='torchscript for TEST.JIT, onnx for TEST.BACKEND onnx.')
+    parser.add_argument('--num_runs', type=int, default=3, help='Number of random inputs of the equivalence check.')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Tolerated absolute difference of the outputs.')
+
+    args = parser.parse_args()
+
+    if not export(args.tracker_name, args.tracker_param, args.dataset_name, args.format, args.num_runs, args.atol):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
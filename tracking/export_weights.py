@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+import torch
+
+prj_path = os.path.join(os.path.dirname(__file__), '..')
+if prj_path not in sys.path:
+    sys.path.append(prj_path)
+
+from lib.test.evaluation.tracker import Tracker
+from lib.models.MTAtrack.weights import save_flat_weights
+from lib.test.tracker.MTAtrack_utils import REFERENCE_PARAMS, get_copying_options
+
+
+def get_rss():
+    """Resident memory of the process in MB: (total, private, file backed). Linux only."""
+    rss = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, val = line.partition(':')
+            if key in ('VmRSS', 'RssAnon', 'RssFile'):
+                rss[key] = int(val.split()[0]) / 1024
+    return rss.get('VmRSS', 0.0), rss.get('RssAnon', 0.0), rss.get('RssFile', 0.0)
+
+
+def measure_startup(tracker_name, tracker_param, dataset_name, flat_weights, weights_path, queue):
+    """Create the tracker in a fresh process and report its start-up time and the memory it added."""
+    tracker_info = Tracker(tracker_name, tracker_param, dataset_name,
+                           param_overrides={'flat_weights': flat_weights, 'weights_path': weights_path})
+    params = tracker_info.get_parameters()
+    rss_before = get_rss()
+    tic = time.time()
+    tracker_info.create_tracker(params)
+    startup = time.time() - tic
+    rss_after = get_rss()
+    queue.put((startup, [after - before for after, before in zip(rss_after, rss_before)]))
+
+
+def report(tracker_name, tracker_param, weights_path, dataset_name='lasot'):
+    """Compare the start-up of the tracker configured by the parameter file with the checkpoint and the weights."""
+    params = Tracker(tracker_name, tracker_param, dataset_name).get_parameters()
+    if get_copying_options(params):
+        raise ValueError("The flat weights are not used as they are with %s, turn these options off."
+                         % ", ".join(get_copying_options(params)))
+    options = ['{}={}'.format(name, params.get(name, val)) for name, val in REFERENCE_PARAMS.items()
+               if name != 'flat_weights']
+    print('Tracker {} {} on {}, inference options: {}'.format(tracker_name, tracker_param,
+                                                             params.get('device', 'cuda'), ', '.join(options)))
+    ctx = mp.get_context('spawn')
+    print('%-12s %10s %10s %10s %10s' % ('weights', 'start-up', 'RSS', 'private', 'shared'))
+    for flat_weights in [False, True]:
+        queue = ctx.Queue()
+        process = ctx.Process(target=measure_startup,
+                              args=(tracker_name, tracker_param, dataset_name, flat_weights, weights_path, queue))
+        process.start()
+        startup, (rss, rss_anon, rss_file) = queue.get()
+        process.join()
+        print('%-12s %9.2fs %8.1fMB %8.1fMB %8.1fMB' % ('flat' if flat_weights else 'checkpoint', startup, rss,
+                                                          rss_anon, rss_file))
+
+
+def export(tracker_name, tracker_param, dataset_name='lasot', fp16=False, output_path=None):
+    """Convert the training checkpoint of the parameter file to the flat weight file at params.weights_path."""
+    tracker_info = Tracker(tracker_name, tracker_param, dataset_name)
+    params = tracker_info.get_parameters()
+    output_path = params.weights_path if output_path is None else output_path
+    state_dict = torch.load(params.checkpoint, map_location='cpu')['net']
+    save_flat_weights(state_dict, output_path, fp16=fp16)
+    print('Saved the weights of {} to {} ({:.1f}MB)'.format(params.checkpoint, output_path,
+                                                           os.path.getsize(output_path) / 2 ** 20))
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the memory-mappable inference weights of a checkpoint.')
+    parser.add_argument('tracker_name', type=str, help='Name of tracking method.')
+    parser.add_argument('tracker_param', type=str, help='Name of config file.')
+    parser.add_argument('--dataset_name', type=str, default='lasot', help='Name of dataset.')
+    parser.add_argument('--fp16', action='store_true',
+                        help='Store the float tensors in half precision, they are not shared across processes then.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Where to save the weights, default is params.weights_path.')
+    parser.add_argument('--report', action='store_true',
+                        help='Compare the tracker start-up time and memory with the checkpoint and the weight file.')
+
+    args = parser.parse_args()
+
+    weights_path = export(args.tracker_name, args.tracker_param, args.dataset_name, args.fp16, args.output)
+    if args.report:
+        report(args.tracker_name, args.tracker_param, weights_path, args.dataset_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,11 +8,12 @@ if prj_path not in sys.path:
 
 from lib.test.evaluation import get_dataset
 from lib.test.evaluation.running import run_dataset
+from lib.test.evaluation.batch_running import run_dataset_batched
 from lib.test.evaluation.tracker import Tracker
 
 
 def run_tracker(tracker_name, tracker_param, run_id=None, dataset_name='got10k_test', sequence=None, debug=0, threads=0,
-                num_gpus=8):
+                num_gpus=8, batch_size=0):
     """Run tracker on sequence or dataset.
     args:
         tracker_name: Name of tracking method.
@@ -22,6 +23,7 @@ def run_tracker(tracker_name, tracker_param, run_id=None, dataset_name='got10k_t
         sequence: Sequence number or name.
         debug: Debug level.
         threads: Number of threads.
+        batch_size: Number of sequences tracked in lock step on one network, 0 runs them one by one.
     """
 
     dataset = get_dataset(dataset_name)
@@ -31,7 +33,10 @@ def run_tracker(tracker_name, tracker_param, run_id=None, dataset_name='got10k_t
 
     trackers = [Tracker(tracker_name, tracker_param, dataset_name, run_id)]
 
-    run_dataset(dataset, trackers, debug, threads, num_gpus=num_gpus)
+    if batch_size > 0:
+        run_dataset_batched(dataset, trackers[0], batch_size, debug)
+    else:
+        run_dataset(dataset, trackers, debug, threads, num_gpus=num_gpus)
 
 
 def main():
@@ -44,6 +49,8 @@ def main():
     parser.add_argument('--debug', type=int, default=0, help='Debug level.')
     parser.add_argument('--threads', type=int, default=0, help='Number of threads.')
     parser.add_argument('--num_gpus', type=int, default=4)
+    parser.add_argument('--batch_size', type=int, default=0,
+                        help='Number of sequences tracked in lock step on one network (MTAtrack only), 0 disables.')
 
     args = parser.parse_args()
 
@@ -53,7 +60,7 @@ def main():
         seq_name = args.sequence
 
     run_tracker(args.tracker_name, args.tracker_param, args.runid, args.dataset_name, seq_name, args.debug,
-                args.threads, num_gpus=args.num_gpus)
+                args.threads, num_gpus=args.num_gpus, batch_size=args.batch_size)
 
 
 if __name__ == '__main__':
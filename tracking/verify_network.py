@@ -0,0 +1,99 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+prj_path = os.path.join(os.path.dirname(__file__), '..')
+if prj_path not in sys.path:
+    sys.path.append(prj_path)
+
+from lib.test.evaluation.tracker import Tracker
+from lib.test.tracker.MTAtrack_utils import REFERENCE_PARAMS
+
+
+def get_data(sz, pad):
+    """Random uint8 BGR image patch (H,W,3) and its attention mask, the last `pad` columns and rows are padding
+    as in the crops of sample_target."""
+    img_patch = np.random.randint(0, 256, (sz, sz, 3), dtype=np.uint8)
+    att_mask = np.zeros((sz, sz))
+    if pad > 0:
+        img_patch[-pad:, :] = 0
+        img_patch[:, -pad:] = 0
+        att_mask[-pad:, :] = 1
+        att_mask[:, -pad:] = 1
+    return img_patch, att_mask
+
+
+def preprocess(tracker, data):
+    img_patch, att_mask = data
+    if not tracker.expects_bgr_input():
+        img_patch = np.ascontiguousarray(img_patch[..., ::-1])
+    return tracker.preprocessor.process(img_patch, att_mask)
+
+
+def run_network(tracker, templates, search):
+    """Forward the templates and the search region through the tracker engine like the tracker does."""
+    engine, token_buffer = tracker.engine, tracker.token_buffer
+    z_dicts = [engine.forward_backbone(preprocess(tracker, t)) for t in templates]
+    token_buffer.allocate(z_dicts[0])
+    for idx, z_dict in enumerate(z_dicts):
+        token_buffer.set_template(idx, z_dict)
+    x_dict = engine.forward_backbone(preprocess(tracker, search))
+    token_buffer.set_search(x_dict)
+    out_dict = engine.forward_transformer(token_buffer.seq_dict, run_cls_head=True)
+    return {k: v.float().cpu() for k, v in out_dict.items()}
+
+
+def builds_dense_mask(tracker, sz):
+    """Whether the backbone builds the dense padding mask of an unpadded crop, which is described by its rectangle
+    (see NestedRectTensor) and should stay so on the eager network."""
+    search = preprocess(tracker, get_data(sz, 0))
+    x_dict = tracker.engine.forward_backbone(search)
+    return getattr(search, '_mask', None) is not None or x_dict["mask"] is not None
+
+
+def verify(tracker_name, tracker_param, dataset_name='lasot', num_runs=3, atol=1e-4):
+    """Compare the network configured by the parameter file with the plain network on random inputs."""
+    reference_info = Tracker(tracker_name, tracker_param, dataset_name, param_overrides=REFERENCE_PARAMS)
+    reference = reference_info.create_tracker(reference_info.get_parameters())
+    optimized_info = Tracker(tracker_name, tracker_param, dataset_name)
+    optimized = optimized_info.create_tracker(optimized_info.get_parameters())
+    params = optimized.params
+    num_templates = optimized.token_buffer.num_templates
+
+    max_diff = 0.0
+    for i in range(num_runs):
+        # the first run has no padding, the following ones pad the crops
+        templates = [get_data(params.template_size, 8 * i) for _ in range(num_templates)]
+        search = get_data(params.search_size, 16 * i)
+        out_ref = run_network(reference, templates, search)
+        out_opt = run_network(optimized, templates, search)
+        for key, val in out_ref.items():
+            diff = (val - out_opt[key]).abs().max().item()
+            print('run %d, %s: max abs diff %.3e' % (i, key, diff))
+            max_diff = max(max_diff, diff)
+    print('max abs diff is %.3e (tolerance %.1e)' % (max_diff, atol))
+    dense_mask = False
+    if params.get('backend', 'torch') == 'torch' and not params.get('jit', False):
+        # the exported graphs take the dense mask as an input
+        dense_mask = builds_dense_mask(optimized, params.search_size)
+        print('unpadded crop builds a dense mask: %s' % dense_mask)
+    return max_diff <= atol and not dense_mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the optimized inference network matches the plain one.')
+    parser.add_argument('tracker_name', type=str, help='Name of tracking method.')
+    parser.add_argument('tracker_param', type=str, help='Name of config file.')
+    parser.add_argument('--dataset_name', type=str, default='lasot', help='Name of dataset, selects the update intervals.')
+    parser.add_argument('--num_runs', type=int, default=3, help='Number of random inputs.')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Tolerated absolute difference of the outputs.')
+
+    args = parser.parse_args()
+
+    if not verify(args.tracker_name, args.tracker_param, args.dataset_name, args.num_runs, args.atol):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()